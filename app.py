@@ -330,6 +330,21 @@ cleanup_thread = Thread(target=log_cleanup_scheduler, daemon=True)
 cleanup_thread.start()
 
 
+def wal_checkpoint_scheduler():
+    """Background thread to checkpoint the database WAL off the request path."""
+    while True:
+        time.sleep(30)
+        try:
+            db.checkpoint_wal()
+        except Exception as e:
+            print(f"WAL checkpoint error: {e}")
+
+
+# Start the WAL checkpoint scheduler
+checkpoint_thread = Thread(target=wal_checkpoint_scheduler, daemon=True)
+checkpoint_thread.start()
+
+
 def load_metadata():
     """Load scripts metadata from JSON file."""
     if os.path.exists(METADATA_FILE):
@@ -3214,8 +3229,7 @@ def api_get_all_positions():
     print(f"Returning {len(all_positions)} total positions from all accounts")
 
     # Save to database and update cache time
-    db.save_open_positions(all_positions)
-    db.set_positions_cache_time(time.time())
+    db.save_open_positions(all_positions, timestamp=time.time())
 
     return jsonify(all_positions)
 
@@ -4400,8 +4414,8 @@ def api_sync_account_trades(account_id):
         all_symbols = [s['symbol'] for s in exchange_info['symbols'] if s['status'] == 'TRADING']
         print(f"Found {len(all_symbols)} trading symbols on exchange")
 
-        new_trades = 0
         total_checked = 0
+        new_trades = 0
 
         # Get symbols from current positions
         print("Fetching current positions to find active symbols...")
@@ -4449,6 +4463,7 @@ def api_sync_account_trades(account_id):
 
             print(f"  Fetching week {weeks - week_num}/{weeks}: {week_start.strftime('%Y-%m-%d')} to {week_end.strftime('%Y-%m-%d')}")
 
+            trade_rows = []
             for symbol in symbols_to_sync:
                 if symbol not in all_symbols:
                     continue
@@ -4477,23 +4492,19 @@ def api_sync_account_trades(account_id):
                                 print(f"  Warning: Skipping trade with missing fields: {trade}")
                                 continue
 
-                            # Insert trade (will skip if already exists based on exchange_trade_id)
-                            inserted = db.insert_trade(
-                                account_id=account_id,
-                                exchange_trade_id=trade_id,
-                                order_id=order_id,
-                                symbol=trade_symbol,
-                                side=trade_side or 'UNKNOWN',
-                                quantity=float(trade.get('qty', 0)),
-                                price=float(trade.get('price', 0)),
-                                realized_pnl=float(trade.get('realizedPnl', 0)),
-                                commission=float(trade.get('commission', 0)),
-                                commission_asset=trade.get('commissionAsset', ''),
-                                trade_time=datetime.fromtimestamp(trade.get('time', 0) / 1000).isoformat() if trade.get('time') else None
-                            )
-
-                            if inserted:
-                                new_trades += 1
+                            # Queued for the week's bulk insert (skips trades already stored by exchange_trade_id)
+                            trade_rows.append((
+                                trade_id,
+                                order_id,
+                                trade_symbol,
+                                trade_side or 'UNKNOWN',
+                                float(trade.get('qty', 0)),
+                                float(trade.get('price', 0)),
+                                float(trade.get('realizedPnl', 0)),
+                                float(trade.get('commission', 0)),
+                                trade.get('commissionAsset', ''),
+                                datetime.fromtimestamp(trade.get('time', 0) / 1000).isoformat() if trade.get('time') else None
+                            ))
                         except (ValueError, TypeError, KeyError) as e:
                             print(f"  Warning: Error processing trade {trade}: {e}")
                             continue
@@ -4504,6 +4515,9 @@ def api_sync_account_trades(account_id):
                 except Exception as e:
                     print(f"Exception syncing {symbol}: {e}")
 
+            # One transaction per week keeps memory bounded and keeps the weeks
+            # already fetched if a later request fails
+            new_trades += db.insert_trades_bulk(account_id, trade_rows)
             weeks_processed += 1
 
         # Update account stats in database (including balance)
@@ -4570,16 +4584,28 @@ def api_get_trades():
     account_id = request.args.get('account_id', None, type=int)
     symbol = request.args.get('symbol', None)
     limit = request.args.get('limit', 40, type=int)
-    offset = request.args.get('offset', 0, type=int)
-
-    trades = db.get_trades(account_id=account_id, symbol=symbol, limit=limit, offset=offset)
+    offset = request.args.get('offset', 0, type=int)  # deprecated, use before_time/before_id
+    before_time = request.args.get('before_time', None)
+    before_id = request.args.get('before_id', None, type=int)
+    # An empty before_time is the cursor of a trade with no trade_time
+    before = (before_time, before_id) if before_time is not None and before_id is not None else None
+
+    trades = db.get_trades(account_id=account_id, symbol=symbol, limit=limit, offset=offset,
+                           before=before)
     total = db.get_trades_count(account_id=account_id, symbol=symbol)
 
+    # Keyset cursor for the next page, offered to keyset callers only (first page or
+    # before_time/before_id); None once the last page has been served
+    next_cursor = None
+    if (before is not None or offset == 0) and len(trades) == limit:
+        next_cursor = {'before_time': trades[-1]['trade_time'] or '', 'before_id': trades[-1]['id']}
+
     return jsonify({
         'trades': trades,
         'total': total,
         'limit': limit,
-        'offset': offset
+        'offset': offset,
+        'next_cursor': next_cursor
     })
 
 
@@ -4620,8 +4646,9 @@ def api_get_closed_positions():
     limit = request.args.get('limit', 40, type=int)
     offset = request.args.get('offset', 0, type=int)
 
-    positions = db.get_closed_positions(account_id=account_id, symbol=symbol, limit=limit, offset=offset)
-    total = db.get_closed_positions_count(account_id=account_id, symbol=symbol)
+    positions, total = db.get_closed_positions(
+        account_id=account_id, symbol=symbol, limit=limit, offset=offset, with_total=True
+    )
 
     return jsonify({
         'positions': positions,
@@ -5027,17 +5054,18 @@ def send_push_notification(title, body, symbol, event_type='trade'):
         print("[NOTIFICATIONS] VAPID_PRIVATE_KEY not set - cannot send push notifications")
         return
 
-    subscriptions = db.get_all_push_subscriptions()
-    for sub in subscriptions:
+    data = json.dumps({
+        'title': title,
+        'body': body,
+        'symbol': symbol,
+        'event_type': event_type
+    })
+
+    for sub in db.iter_push_subscriptions():
         try:
             webpush(
                 subscription_info=sub,
-                data=json.dumps({
-                    'title': title,
-                    'body': body,
-                    'symbol': symbol,
-                    'event_type': event_type
-                }),
+                data=data,
                 vapid_private_key=vapid_private_key,
                 vapid_claims=vapid_claims
             )
@@ -5106,40 +5134,52 @@ def check_trade_positions():
                     # Get previous snapshots
                     prev_snapshots = db.get_position_snapshots(account_id)
 
+                    # Collect this account's changes and write them in one batch
+                    notifications = []
+                    snapshot_rows = []
+                    closed_symbols = []
+                    push_messages = []
+
                     # Check for new positions (opened)
                     for symbol, pos in current_positions.items():
                         if symbol not in prev_snapshots:
                             # New position opened
-                            db.add_trade_notification(
+                            notifications.append((
                                 account_id, symbol, pos['side'], 'opened',
-                                entry_price=pos['entry_price']
-                            )
+                                pos['entry_price'], None, None
+                            ))
                             print(f"[NOTIFICATIONS] {account_name}: {symbol} {pos['side']} opened @ ${pos['entry_price']:.4f}")
 
                             title = f"Trade Opened: {symbol}"
                             body = f"{account_name}: {pos['side']} @ ${pos['entry_price']:.4f}"
-                            send_push_notification(title, body, symbol, 'opened')
+                            push_messages.append((title, body, symbol, 'opened'))
 
                         # Update snapshot
-                        db.update_position_snapshot(
+                        snapshot_rows.append((
                             account_id, symbol, pos['side'],
                             pos['entry_price'], pos['quantity']
-                        )
+                        ))
 
                     # Check for closed positions
                     for symbol, prev_pos in prev_snapshots.items():
                         if symbol not in current_positions:
                             # Position closed
-                            db.add_trade_notification(
+                            notifications.append((
                                 account_id, symbol, prev_pos['side'], 'closed',
-                                entry_price=prev_pos['entry_price']
-                            )
-                            db.delete_position_snapshot(account_id, symbol)
+                                prev_pos['entry_price'], None, None
+                            ))
+                            closed_symbols.append(symbol)
                             print(f"[NOTIFICATIONS] {account_name}: {symbol} {prev_pos['side']} closed")
 
                             title = f"Trade Closed: {symbol}"
                             body = f"{account_name}: {prev_pos['side']} closed (Entry: ${prev_pos['entry_price']:.4f})"
-                            send_push_notification(title, body, symbol, 'closed')
+                            push_messages.append((title, body, symbol, 'closed'))
+
+                    db.save_position_changes(account_id, notifications, snapshot_rows, closed_symbols)
+
+                    # Send pushes only after the events are recorded
+                    for title, body, symbol, event_type in push_messages:
+                        send_push_notification(title, body, symbol, event_type)
 
                 except Exception as e:
                     print(f"[NOTIFICATIONS] Error checking account {account.get('name', account_id)}: {e}")
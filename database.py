@@ -7,29 +7,233 @@ Stores accounts and trades synced from Binance.
 import sqlite3
 import os
 import hashlib
+import hmac
+import queue
 import secrets
-from datetime import datetime, timedelta
-from threading import Lock
-
-# Database path
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trades.db')
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from itertools import groupby
+from operator import itemgetter
+from threading import Lock, local
+
+# Use orjson for the journal tag lists when available
+try:
+    import orjson
+
+    def _json_dumps(value):
+        return orjson.dumps(value).decode()
+
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+# Hash new passwords with argon2id when argon2-cffi is available, scrypt otherwise
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+    _argon2 = PasswordHasher()
+except ImportError:
+    _argon2 = None
+
+# Database path; TRADES_DB_PATH points it elsewhere (e.g. a scratch file for the tests)
+DB_PATH = os.environ.get('TRADES_DB_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'trades.db')
+
+# In-process writers take turns on the single write connection; writers in other processes
+# queue on SQLite's lock (BEGIN IMMEDIATE + busy_timeout), retried this many times
+WRITE_LOCK_RETRIES = 3
+
+# Bump whenever init_db() changes tables, columns or indexes so existing databases migrate
+SCHEMA_VERSION = 13
+# Stamped into the database header ('TBOT') so the file identifies itself as this app's
+APPLICATION_ID = 0x54424F54
+
+# Idle read-only connections, opened lazily and reused across calls and threads. LIFO hands
+# out the most recently returned connection, whose page and statement caches are still warm
+POOL_SIZE = 16
+_read_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+# The one write connection. WAL allows a single writer at a time, so threads wait for this
+# slot in Python instead of polling SQLite's busy handler; None until first opened
+_write_pool = queue.LifoQueue(maxsize=1)
+_write_pool.put(None)
+
+# Connection currently borrowed by this thread, if any, and whether it is the writer
+_held = local()
+
+# Cached UPDATE statements keyed by (table, assignments)
+_update_sql_cache = {}
+
+
+# Per-connection settings, applied in one executescript() call on every new connection
+_CONNECTION_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;      -- safe with WAL, skips the per-commit fsync
+    PRAGMA cache_size=-64000;       -- 64 MB page cache
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;     -- 256 MB memory-mapped I/O
+    PRAGMA foreign_keys=ON;
+    PRAGMA busy_timeout=30000;      -- 30 second busy timeout
+    PRAGMA wal_autocheckpoint=1000; -- pages; keeps the WAL file bounded
+    PRAGMA journal_size_limit=67108864; -- 64 MB; shrink the WAL back after a bulk sync
+    PRAGMA analysis_limit=400;      -- ANALYZE / optimize sample instead of full scans
+"""
 
-# Thread-safe lock for database operations
-db_lock = Lock()
+# journal_mode=WAL is stored in the database file, so it only needs setting once per process
+_wal_enabled = False
 
 
-def get_connection():
-    """Get a database connection with WAL mode for concurrent access."""
-    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+def _open_connection(write):
+    """Open a new database connection with WAL mode and the tuning PRAGMAs applied."""
+    global _wal_enabled
+    # Autocommit: single statements commit on their own, multi-statement writes open
+    # an explicit BEGIN IMMEDIATE so the write lock is taken up front
+    conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=512, check_same_thread=False,
+                           isolation_level=None)
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA foreign_keys=ON")
-    conn.execute("PRAGMA busy_timeout=30000")  # 30 second busy timeout
+    if not _wal_enabled:
+        journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if journal_mode.lower() == 'wal':
+            _wal_enabled = True
+        else:
+            # Lock-free reads assume WAL; in rollback-journal mode they wait on writers
+            print(f"Warning: SQLite journal_mode is {journal_mode}, not WAL; readers will block on writes")
+    conn.executescript(_CONNECTION_PRAGMAS)
+    if not write:
+        # A write through a reader would bypass the writer slot; make it fail loudly
+        conn.execute('PRAGMA query_only=ON')
     return conn
 
 
+def _close_connection(conn):
+    """Refresh planner statistics the connection found stale, then close it."""
+    try:
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error:
+        pass
+    conn.close()
+
+
+@contextmanager
+def get_connection(write=False):
+    """
+    Borrow a database connection for the duration of a with block: a pooled read-only one,
+    or with write=True the single write connection, waiting for it if another thread has it.
+    Nested calls on the same thread share the outer block's connection when it can serve
+    them, so an inner write can't block on the outer one's open transaction.
+    """
+    held = getattr(_held, 'conn', None)
+    held_write = getattr(_held, 'write', False)
+    if held is not None and (held_write or not write):
+        yield held
+        return
+    if write:
+        conn = _write_pool.get()
+    else:
+        try:
+            conn = _read_pool.get_nowait()
+        except queue.Empty:
+            conn = None
+    if conn is None:
+        try:
+            conn = _open_connection(write)
+        except BaseException:
+            if write:
+                _write_pool.put(None)  # Free the slot for the next writer
+            raise
+    _held.conn, _held.write = conn, write
+    try:
+        yield conn
+    finally:
+        _held.conn, _held.write = held, held_write
+        try:
+            if conn.in_transaction:
+                # Failed or abandoned mid-write; discard the partial work
+                conn.rollback()
+        except BaseException:
+            # Don't pool a connection in an unknown state, but always free the writer slot
+            conn.close()
+            if write:
+                _write_pool.put(None)
+            raise
+        try:
+            (_write_pool if write else _read_pool).put_nowait(conn)
+        except queue.Full:
+            _close_connection(conn)
+
+
+def _begin_immediate(cursor):
+    """Open a write transaction, backing off and retrying if the database stays locked."""
+    for attempt in range(WRITE_LOCK_RETRIES):
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) or attempt == WRITE_LOCK_RETRIES - 1:
+                raise
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def _update_sql(table, assignments):
+    """Return a cached UPDATE ... WHERE id = ? statement for the given assignments."""
+    key = (table, assignments)
+    sql = _update_sql_cache.get(key)
+    if sql is None:
+        sql = f'UPDATE {table} SET {", ".join(assignments)} WHERE id = ?'
+        _update_sql_cache[key] = sql
+    return sql
+
+
+def _build_update_templates(table, columns, prefix=None):
+    """Precompute UPDATE ... WHERE id = ? statements keyed by bitmask (bit i set = columns[i] updated)."""
+    templates = {}
+    for mask in range(1 << len(columns)):
+        assignments = [prefix] if prefix else []
+        assignments += [f'{col} = ?' for bit, col in enumerate(columns) if mask & (1 << bit)]
+        if assignments:
+            templates[mask] = f'UPDATE {table} SET {", ".join(assignments)} WHERE id = ?'
+    return templates
+
+
+_UPDATE_SETUP_SQL = _build_update_templates(
+    'setups', ('name', 'folder_id', 'description', 'timeframe', 'image_data', 'notes'),
+    prefix='updated_at = CURRENT_TIMESTAMP'
+)
+_UPDATE_SETUP_IMAGE_SQL = _build_update_templates(
+    'setup_images', ('timeframe', 'notes', 'display_order')
+)
+_UPDATE_JOURNAL_SQL = _build_update_templates(
+    'closed_positions', ('journal_notes', 'emotion_tags', 'mistake_tags', 'rating')
+)
+
+
+def checkpoint_wal():
+    """
+    Copy committed WAL frames back into the database file without waiting on readers or
+    writers (PASSIVE), so the automatic checkpoint rarely lands inside a request's commit.
+    Returns (busy, wal_frames, checkpointed_frames).
+    """
+    with get_connection() as conn:
+        return tuple(conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone())
+
+
 def close_all_connections():
-    """Close all database connections and checkpoint WAL file."""
+    """Close all pooled database connections and checkpoint WAL file."""
+    while True:
+        try:
+            _close_connection(_read_pool.get_nowait())
+        except queue.Empty:
+            break
+    try:
+        conn = _write_pool.get(timeout=5)
+    except queue.Empty:
+        pass  # A write is still running; leave its connection alone
+    else:
+        if conn is not None:
+            _close_connection(conn)
+        _write_pool.put(None)
     try:
         conn = sqlite3.connect(DB_PATH, timeout=5)
         conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
@@ -38,12 +242,264 @@ def close_all_connections():
         pass
 
 
+def _table_columns(cursor, table):
+    """Return the set of column names currently on a table."""
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row['name'] for row in cursor.fetchall()}
+
+
+def _add_missing_columns(cursor, table, columns):
+    """Add whichever (name, definition) columns the table doesn't have yet (migration)."""
+    existing = _table_columns(cursor, table)
+    for col, definition in columns:
+        if col not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {col} {definition}')
+
+
+# Trades and closed_positions DDL, shared by init_db() and the full wipe which
+# drops and recreates both tables instead of deleting row by row
+# Columns in storage order: filter/aggregate columns lead so record decoding stops early,
+# rarely read ones (commission_asset, created_at) trail. trade_time holds ISO-8601 text, which
+# sorts chronologically, so MAX() and ORDER BY trade_time seek the composite indexes directly
+_TRADES_COLUMNS = (
+    'id', 'account_id', 'exchange_trade_id', 'symbol', 'trade_time', 'realized_pnl',
+    'side', 'quantity', 'price', 'commission', 'order_id', 'commission_asset', 'created_at',
+)
+_TRADES_DDL = '''
+    CREATE TABLE IF NOT EXISTS trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        exchange_trade_id TEXT UNIQUE,
+        symbol TEXT NOT NULL,
+        trade_time TIMESTAMP,
+        realized_pnl REAL DEFAULT 0,
+        side TEXT NOT NULL CHECK(side IN ('LONG', 'SHORT', 'BUY', 'SELL')),
+        quantity REAL NOT NULL,
+        price REAL NOT NULL,
+        commission REAL DEFAULT 0,
+        order_id TEXT,
+        commission_asset TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    )
+'''
+# (name, DDL) pairs; all non-unique, so a large bulk load drops these and rebuilds them afterwards
+_TRADES_INDEXES = (
+    ('idx_trades_symbol', 'CREATE INDEX IF NOT EXISTS idx_trades_symbol ON trades(symbol)'),
+    ('idx_trades_trade_time', 'CREATE INDEX IF NOT EXISTS idx_trades_trade_time ON trades(trade_time)'),
+    # Paged trade lists walk these in order and stop at LIMIT
+    ('idx_trades_account_time',
+     'CREATE INDEX IF NOT EXISTS idx_trades_account_time ON trades(account_id, trade_time DESC)'),
+    ('idx_trades_account_symbol_time',
+     'CREATE INDEX IF NOT EXISTS idx_trades_account_symbol_time ON trades(account_id, symbol, trade_time DESC)'),
+)
+_CLOSED_POSITIONS_DDL = '''
+    CREATE TABLE IF NOT EXISTS closed_positions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        symbol TEXT NOT NULL,
+        side TEXT NOT NULL,
+        quantity REAL NOT NULL,
+        entry_price REAL NOT NULL,
+        exit_price REAL NOT NULL,
+        size_usd REAL NOT NULL,
+        realized_pnl REAL NOT NULL,
+        commission REAL DEFAULT 0,
+        entry_time TIMESTAMP,
+        exit_time TIMESTAMP,
+        duration_seconds INTEGER,
+        trade_ids TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        setup_id INTEGER REFERENCES setups(id) ON DELETE SET NULL,
+        journal_notes TEXT,
+        emotion_tags TEXT,
+        mistake_tags TEXT,
+        rating INTEGER,
+        FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    )
+'''
+_CLOSED_POSITIONS_INDEXES = (
+    # Per-account history (newest first) and per-account symbol filters
+    'CREATE INDEX IF NOT EXISTS idx_closed_positions_account_exit ON closed_positions(account_id, exit_time DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_closed_positions_account_symbol_exit ON closed_positions(account_id, symbol, exit_time DESC)',
+    'CREATE INDEX IF NOT EXISTS idx_closed_positions_exit_time ON closed_positions(exit_time)',
+    # Covering index for the per-setup pnl aggregates
+    'CREATE INDEX IF NOT EXISTS idx_closed_positions_setup_pnl ON closed_positions(setup_id, realized_pnl)',
+    # Lets the summary triggers re-read an account's max/min pnl without a scan
+    'CREATE INDEX IF NOT EXISTS idx_closed_positions_account_pnl ON closed_positions(account_id, realized_pnl)',
+)
+# Per-account running totals behind get_closed_positions_stats, kept current by triggers
+# on closed_positions so the stats read is a single-row lookup instead of a scan
+_CLOSED_POSITIONS_SUMMARY_DDL = '''
+    CREATE TABLE IF NOT EXISTS closed_positions_summary (
+        account_id INTEGER PRIMARY KEY,
+        total_positions INTEGER NOT NULL DEFAULT 0,
+        sum_pnl REAL NOT NULL DEFAULT 0,
+        sum_commission REAL NOT NULL DEFAULT 0,
+        sum_volume REAL NOT NULL DEFAULT 0,
+        winning INTEGER NOT NULL DEFAULT 0,
+        losing INTEGER NOT NULL DEFAULT 0,
+        breakeven INTEGER NOT NULL DEFAULT 0,
+        sum_win REAL NOT NULL DEFAULT 0,
+        sum_loss REAL NOT NULL DEFAULT 0,
+        max_pnl REAL,
+        min_pnl REAL,
+        sum_duration INTEGER NOT NULL DEFAULT 0,
+        duration_count INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+    )
+'''
+# Trigger bodies adding NEW / removing OLD from the summary. Removing the current max or
+# min re-reads it through idx_closed_positions_account_pnl; a summary emptied by deletes
+# is dropped so float residue from the subtractions doesn't linger
+_SUMMARY_ADD_ROW = '''
+    INSERT INTO closed_positions_summary (
+        account_id, total_positions, sum_pnl, sum_commission, sum_volume, winning, losing,
+        breakeven, sum_win, sum_loss, max_pnl, min_pnl, sum_duration, duration_count
+    ) VALUES (
+        NEW.account_id, 1, NEW.realized_pnl, COALESCE(NEW.commission, 0),
+        NEW.quantity * NEW.entry_price, NEW.realized_pnl > 0, NEW.realized_pnl < 0,
+        NEW.realized_pnl = 0, MAX(NEW.realized_pnl, 0), MIN(NEW.realized_pnl, 0),
+        NEW.realized_pnl, NEW.realized_pnl, COALESCE(NEW.duration_seconds, 0),
+        NEW.duration_seconds IS NOT NULL
+    )
+    ON CONFLICT(account_id) DO UPDATE SET
+        total_positions = total_positions + 1,
+        sum_pnl = sum_pnl + excluded.sum_pnl,
+        sum_commission = sum_commission + excluded.sum_commission,
+        sum_volume = sum_volume + excluded.sum_volume,
+        winning = winning + excluded.winning,
+        losing = losing + excluded.losing,
+        breakeven = breakeven + excluded.breakeven,
+        sum_win = sum_win + excluded.sum_win,
+        sum_loss = sum_loss + excluded.sum_loss,
+        max_pnl = MAX(COALESCE(max_pnl, excluded.max_pnl), excluded.max_pnl),
+        min_pnl = MIN(COALESCE(min_pnl, excluded.min_pnl), excluded.min_pnl),
+        sum_duration = sum_duration + excluded.sum_duration,
+        duration_count = duration_count + excluded.duration_count;
+'''
+_SUMMARY_REMOVE_ROW = '''
+    UPDATE closed_positions_summary SET
+        total_positions = total_positions - 1,
+        sum_pnl = sum_pnl - OLD.realized_pnl,
+        sum_commission = sum_commission - COALESCE(OLD.commission, 0),
+        sum_volume = sum_volume - OLD.quantity * OLD.entry_price,
+        winning = winning - (OLD.realized_pnl > 0),
+        losing = losing - (OLD.realized_pnl < 0),
+        breakeven = breakeven - (OLD.realized_pnl = 0),
+        sum_win = sum_win - MAX(OLD.realized_pnl, 0),
+        sum_loss = sum_loss - MIN(OLD.realized_pnl, 0),
+        max_pnl = CASE WHEN OLD.realized_pnl < max_pnl THEN max_pnl ELSE (
+            SELECT MAX(realized_pnl) FROM closed_positions WHERE account_id = OLD.account_id
+        ) END,
+        min_pnl = CASE WHEN OLD.realized_pnl > min_pnl THEN min_pnl ELSE (
+            SELECT MIN(realized_pnl) FROM closed_positions WHERE account_id = OLD.account_id
+        ) END,
+        sum_duration = sum_duration - COALESCE(OLD.duration_seconds, 0),
+        duration_count = duration_count - (OLD.duration_seconds IS NOT NULL)
+    WHERE account_id = OLD.account_id;
+    DELETE FROM closed_positions_summary WHERE account_id = OLD.account_id AND total_positions <= 0;
+'''
+_CLOSED_POSITIONS_TRIGGERS = (
+    f'''CREATE TRIGGER IF NOT EXISTS trg_closed_positions_summary_insert
+        AFTER INSERT ON closed_positions BEGIN {_SUMMARY_ADD_ROW} END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_closed_positions_summary_delete
+        AFTER DELETE ON closed_positions BEGIN {_SUMMARY_REMOVE_ROW} END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_closed_positions_summary_update
+        AFTER UPDATE OF account_id, realized_pnl, commission, quantity, entry_price, duration_seconds
+        ON closed_positions BEGIN {_SUMMARY_REMOVE_ROW} {_SUMMARY_ADD_ROW} END''',
+)
+# Recomputes every account's summary from scratch (migrations)
+_REBUILD_CLOSED_POSITIONS_SUMMARY = '''
+    INSERT INTO closed_positions_summary (
+        account_id, total_positions, sum_pnl, sum_commission, sum_volume, winning, losing,
+        breakeven, sum_win, sum_loss, max_pnl, min_pnl, sum_duration, duration_count
+    )
+    SELECT
+        account_id, COUNT(*), SUM(realized_pnl), COALESCE(SUM(commission), 0),
+        SUM(quantity * entry_price), SUM(realized_pnl > 0), SUM(realized_pnl < 0),
+        SUM(realized_pnl = 0), SUM(MAX(realized_pnl, 0)), SUM(MIN(realized_pnl, 0)),
+        MAX(realized_pnl), MIN(realized_pnl), COALESCE(SUM(duration_seconds), 0),
+        COUNT(duration_seconds)
+    FROM closed_positions
+    GROUP BY account_id
+'''
+
+
+def _rebuild_trades_table(cursor):
+    """Copy trades into a table laid out in _TRADES_COLUMNS order and swap it in place of the old one."""
+    columns = ', '.join(_TRADES_COLUMNS)
+    cursor.execute('DROP TABLE IF EXISTS trades_new')
+    cursor.execute(_TRADES_DDL.replace('trades', 'trades_new', 1))
+    cursor.execute(f'INSERT INTO trades_new ({columns}) SELECT {columns} FROM trades')
+    # Keep AUTOINCREMENT from reissuing ids of trades deleted off the end
+    cursor.execute('''
+        UPDATE sqlite_sequence SET seq = (SELECT seq FROM sqlite_sequence WHERE name = 'trades')
+        WHERE name = 'trades_new' AND EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'trades')
+    ''')
+    cursor.execute('DROP TABLE trades')
+    cursor.execute('ALTER TABLE trades_new RENAME TO trades')
+
+
+# Small tables looked up by a TEXT primary key. WITHOUT ROWID stores each as one B-tree keyed
+# on that column instead of a rowid table plus a separate primary key index
+_KEY_VALUE_DDL = {
+    'app_settings': '''
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''',
+    'cache_meta': '''
+        CREATE TABLE IF NOT EXISTS cache_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''',
+    'settings': '''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''',
+}
+
+
+def _create_key_value_table(cursor, table):
+    """Create a _KEY_VALUE_DDL table, rewriting a rowid-based copy from older schemas in place."""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    row = cursor.fetchone()
+    if row is not None and 'WITHOUT ROWID' in row['sql'].upper():
+        return
+    ddl = _KEY_VALUE_DDL[table]
+    if row is None:
+        cursor.execute(ddl)
+        return
+    cursor.execute(f'DROP TABLE IF EXISTS {table}_new')
+    cursor.execute(ddl.replace(table, f'{table}_new', 1))
+    cursor.execute(f'INSERT INTO {table}_new SELECT * FROM {table}')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+
+
 def init_db():
     """Initialize the database with tables."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        # Schema already migrated by this (or a newer) version: nothing to do
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return
+
+        # Apply the whole migration atomically; another worker may have finished it while
+        # this one waited for the write lock
+        _begin_immediate(cursor)
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] >= SCHEMA_VERSION:
+            return
+
         # Users table for authentication
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -56,12 +512,7 @@ def init_db():
         ''')
 
         # App settings table (for registration restriction)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS app_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            )
-        ''')
+        _create_key_value_table(cursor, 'app_settings')
 
         # Initialize registration_open setting if not exists
         cursor.execute('INSERT OR IGNORE INTO app_settings (key, value) VALUES (?, ?)',
@@ -94,58 +545,55 @@ def init_db():
         ''')
 
         # Add new columns if they don't exist (migration for existing databases)
-        for col, col_type, default in [
-            ('total_trades', 'INTEGER', 0),
-            ('total_pnl', 'REAL', 0),
-            ('total_commission', 'REAL', 0),
-            ('winning_trades', 'INTEGER', 0),
-            ('losing_trades', 'INTEGER', 0),
-            ('current_balance', 'REAL', 0),
-            ('starting_balance', 'REAL', 0),
-            ('avg_win', 'REAL', 0),
-            ('avg_loss', 'REAL', 0),
-            ('largest_win', 'REAL', 0),
-            ('largest_loss', 'REAL', 0),
-            ('profit_factor', 'REAL', 0),
-            ('total_volume', 'REAL', 0),
-            ('last_sync_time', 'TIMESTAMP', None)
-        ]:
-            try:
-                cursor.execute(f'ALTER TABLE accounts ADD COLUMN {col} {col_type} DEFAULT {default if default is not None else "NULL"}')
-            except sqlite3.OperationalError:
-                pass  # Column already exists
+        _add_missing_columns(cursor, 'accounts', [
+            ('total_trades', 'INTEGER DEFAULT 0'),
+            ('total_pnl', 'REAL DEFAULT 0'),
+            ('total_commission', 'REAL DEFAULT 0'),
+            ('winning_trades', 'INTEGER DEFAULT 0'),
+            ('losing_trades', 'INTEGER DEFAULT 0'),
+            ('current_balance', 'REAL DEFAULT 0'),
+            ('starting_balance', 'REAL DEFAULT 0'),
+            ('avg_win', 'REAL DEFAULT 0'),
+            ('avg_loss', 'REAL DEFAULT 0'),
+            ('largest_win', 'REAL DEFAULT 0'),
+            ('largest_loss', 'REAL DEFAULT 0'),
+            ('profit_factor', 'REAL DEFAULT 0'),
+            ('total_volume', 'REAL DEFAULT 0'),
+            ('last_sync_time', 'TIMESTAMP DEFAULT NULL'),
+        ])
+
+        # Account list is returned newest first
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_accounts_created_at ON accounts(created_at DESC)')
         
         # Trades table (linked to accounts, with exchange_trade_id for deduplication)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS trades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                account_id INTEGER NOT NULL,
-                exchange_trade_id TEXT UNIQUE,
-                order_id TEXT,
-                symbol TEXT NOT NULL,
-                side TEXT NOT NULL CHECK(side IN ('LONG', 'SHORT', 'BUY', 'SELL')),
-                quantity REAL NOT NULL,
-                price REAL NOT NULL,
-                realized_pnl REAL DEFAULT 0,
-                commission REAL DEFAULT 0,
-                commission_asset TEXT,
-                trade_time TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
-            )
-        ''')
+        cursor.execute(_TRADES_DDL)
         
         # Add account_id column to trades if it doesn't exist (migration for existing databases)
-        try:
-            cursor.execute('ALTER TABLE trades ADD COLUMN account_id INTEGER REFERENCES accounts(id) ON DELETE CASCADE')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-
-        # Create indexes
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trades_account_id ON trades(account_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trades_symbol ON trades(symbol)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trades_trade_time ON trades(trade_time)')
-        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_trades_exchange_id ON trades(exchange_trade_id)')
+        _add_missing_columns(cursor, 'trades', [
+            ('account_id', 'INTEGER REFERENCES accounts(id) ON DELETE CASCADE'),
+        ])
+
+        # Tables created before the column reordering are rewritten once (indexes go with
+        # the old table and are recreated below)
+        cursor.execute('PRAGMA table_info(trades)')
+        if tuple(row['name'] for row in cursor.fetchall()) != _TRADES_COLUMNS:
+            _rebuild_trades_table(cursor)
+
+        # Create indexes; account_id lookups are served by the (account_id, trade_time) prefix
+        cursor.execute('DROP INDEX IF EXISTS idx_trades_account_id')
+        for _, sql in _TRADES_INDEXES:
+            cursor.execute(sql)
+
+        # The column's UNIQUE constraint already indexes exchange_trade_id; a second unique
+        # index on it would be probed and updated by every insert
+        cursor.execute('''
+            SELECT 1 FROM pragma_index_list('trades') il, pragma_index_info(il.name) ii
+            WHERE il.origin = 'u' AND ii.name = 'exchange_trade_id'
+        ''')
+        if cursor.fetchone():
+            cursor.execute('DROP INDEX IF EXISTS idx_trades_exchange_id')
+        else:
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_trades_exchange_id ON trades(exchange_trade_id)')
 
         # Open positions table (cached from Binance)
         cursor.execute('''
@@ -169,46 +617,21 @@ def init_db():
                 UNIQUE(account_id, symbol)
             )
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_positions_account_id ON open_positions(account_id)')
+        # UNIQUE(account_id, symbol) already indexes account_id lookups
+        cursor.execute('DROP INDEX IF EXISTS idx_positions_account_id')
 
         # Cache metadata table (stores last update timestamps)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS cache_meta (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        _create_key_value_table(cursor, 'cache_meta')
 
         # Closed positions table - complete trade cycles from open to close
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS closed_positions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                account_id INTEGER NOT NULL,
-                symbol TEXT NOT NULL,
-                side TEXT NOT NULL,
-                quantity REAL NOT NULL,
-                entry_price REAL NOT NULL,
-                exit_price REAL NOT NULL,
-                size_usd REAL NOT NULL,
-                realized_pnl REAL NOT NULL,
-                commission REAL DEFAULT 0,
-                entry_time TIMESTAMP,
-                exit_time TIMESTAMP,
-                duration_seconds INTEGER,
-                trade_ids TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
-            )
-        ''')
+        cursor.execute(_CLOSED_POSITIONS_DDL)
 
         # Add size_usd column if it doesn't exist (migration)
-        try:
-            cursor.execute('ALTER TABLE closed_positions ADD COLUMN size_usd REAL DEFAULT 0')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_closed_positions_account_id ON closed_positions(account_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_closed_positions_exit_time ON closed_positions(exit_time)')
+        _add_missing_columns(cursor, 'closed_positions', [('size_usd', 'REAL DEFAULT 0')])
+        # Backfill rows stored before size_usd was recorded so reads can use it as-is
+        cursor.execute(
+            'UPDATE closed_positions SET size_usd = quantity * entry_price WHERE COALESCE(size_usd, 0) = 0'
+        )
 
         # Setup folders table (e.g., Grade A, Grade B, Grade C)
         cursor.execute('''
@@ -252,26 +675,34 @@ def init_db():
                 FOREIGN KEY (setup_id) REFERENCES setups(id) ON DELETE CASCADE
             )
         ''')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_setup_images_setup_id ON setup_images(setup_id)')
-
-        # Add setup_id column to closed_positions for trade-setup linking
-        try:
-            cursor.execute('ALTER TABLE closed_positions ADD COLUMN setup_id INTEGER REFERENCES setups(id) ON DELETE SET NULL')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_closed_positions_setup_id ON closed_positions(setup_id)')
-
-        # Add journal columns to closed_positions for trade journaling
-        for col, col_type in [
+        # Covers the per-setup image listing including its ORDER BY
+        cursor.execute('DROP INDEX IF EXISTS idx_setup_images_setup_id')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_setup_images_setup_order ON setup_images(setup_id, display_order, created_at)')
+
+        # Add setup_id column to closed_positions for trade-setup linking, and journal
+        # columns for trade journaling
+        _add_missing_columns(cursor, 'closed_positions', [
+            ('setup_id', 'INTEGER REFERENCES setups(id) ON DELETE SET NULL'),
             ('journal_notes', 'TEXT'),
             ('emotion_tags', 'TEXT'),  # JSON array string
             ('mistake_tags', 'TEXT'),  # JSON array string
             ('rating', 'INTEGER'),
-        ]:
-            try:
-                cursor.execute(f'ALTER TABLE closed_positions ADD COLUMN {col} {col_type}')
-            except sqlite3.OperationalError:
-                pass  # Column already exists
+        ])
+
+        # Superseded by the composite indexes in _CLOSED_POSITIONS_INDEXES
+        cursor.execute('DROP INDEX IF EXISTS idx_closed_positions_account_id')
+        cursor.execute('DROP INDEX IF EXISTS idx_closed_positions_setup_id')
+        cursor.execute('DROP INDEX IF EXISTS idx_closed_positions_account_symbol')
+        cursor.execute('DROP INDEX IF EXISTS idx_closed_positions_account_stats')
+        for sql in _CLOSED_POSITIONS_INDEXES:
+            cursor.execute(sql)
+
+        # Stats summary: (re)built from the current rows, then kept in step by the triggers
+        cursor.execute(_CLOSED_POSITIONS_SUMMARY_DDL)
+        for sql in _CLOSED_POSITIONS_TRIGGERS:
+            cursor.execute(sql)
+        cursor.execute('DELETE FROM closed_positions_summary')
+        cursor.execute(_REBUILD_CLOSED_POSITIONS_SUMMARY)
 
         # Trade notifications history table
         cursor.execute('''
@@ -289,6 +720,13 @@ def init_db():
             )
         ''')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_trade_notifications_account ON trade_notifications(account_id)')
+        # Covering index: the recent-notifications feed reads it in order and stops at LIMIT
+        cursor.execute('DROP INDEX IF EXISTS idx_trade_notifications_created')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_trade_notifications_created_desc ON trade_notifications(
+                created_at DESC, account_id, symbol, side, event_type, entry_price, exit_price, pnl
+            )
+        ''')
 
         # Position snapshots for tracking changes
         cursor.execute('''
@@ -306,12 +744,7 @@ def init_db():
         ''')
 
         # Settings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT NOT NULL
-            )
-        ''')
+        _create_key_value_table(cursor, 'settings')
         # Default: trade notifications enabled
         cursor.execute('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)',
                       ('trade_notifications_enabled', '1'))
@@ -351,10 +784,9 @@ def init_db():
         ''')
 
         # Migration: Add section_id column if it doesn't exist
-        try:
-            cursor.execute("ALTER TABLE trading_rules ADD COLUMN section_id INTEGER REFERENCES rule_sections(id) ON DELETE CASCADE")
-        except sqlite3.OperationalError:
-            pass  # Column already exists
+        _add_missing_columns(cursor, 'trading_rules', [
+            ('section_id', 'INTEGER REFERENCES rule_sections(id) ON DELETE CASCADE'),
+        ])
 
         # Migrate existing rules from rule_type to sections
         cursor.execute("SELECT COUNT(*) as cnt FROM rule_sections")
@@ -415,29 +847,14 @@ def init_db():
         ''')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_strategies_account_id ON strategies(account_id)')
 
-        # Migration: Add crossover columns if they don't exist
-        try:
-            cursor.execute('ALTER TABLE strategies ADD COLUMN crossover_direction TEXT')
-        except:
-            pass
-        try:
-            cursor.execute('ALTER TABLE strategies ADD COLUMN crossover_sl_long REAL')
-        except:
-            pass
-        try:
-            cursor.execute('ALTER TABLE strategies ADD COLUMN crossover_sl_short REAL')
-        except:
-            pass
-        try:
-            cursor.execute('ALTER TABLE strategies ADD COLUMN crossover_time TEXT')
-        except:
-            pass
-
-        # Migration: Add notify_enabled column for push notifications
-        try:
-            cursor.execute('ALTER TABLE strategies ADD COLUMN notify_enabled INTEGER DEFAULT 0')
-        except:
-            pass
+        # Migration: Add crossover columns, and notify_enabled for push notifications
+        _add_missing_columns(cursor, 'strategies', [
+            ('crossover_direction', 'TEXT'),
+            ('crossover_sl_long', 'REAL'),
+            ('crossover_sl_short', 'REAL'),
+            ('crossover_time', 'TEXT'),
+            ('notify_enabled', 'INTEGER DEFAULT 0'),
+        ])
 
         # Auto Trades table
         cursor.execute('''
@@ -458,16 +875,19 @@ def init_db():
         ''')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_auto_trades_account_id ON auto_trades(account_id)')
 
+        # Refresh planner statistics (sampled, so it stays cheap on large tables)
+        cursor.execute('ANALYZE')
+
+        cursor.execute(f'PRAGMA application_id = {APPLICATION_ID}')
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         conn.commit()
-        conn.close()
 
 
 # ==================== ACCOUNT OPERATIONS ====================
 
 def create_account(name, api_key, api_secret, is_testnet=False):
     """Create a new account. Returns account id."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
         
         cursor.execute(
@@ -477,82 +897,66 @@ def create_account(name, api_key, api_secret, is_testnet=False):
         account_id = cursor.lastrowid
         
         conn.commit()
-        conn.close()
         return account_id
 
 
+# Account figures rounded to cents in get_all_accounts
+_ACCOUNT_MONEY_FIELDS = (
+    'total_pnl', 'total_commission', 'current_balance', 'starting_balance', 'net_profit',
+    'avg_win', 'avg_loss', 'largest_win', 'largest_loss', 'profit_factor', 'total_volume',
+)
+
+
 def get_all_accounts():
     """Get all accounts with trade statistics."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
+        # Key masking, defaults and derived ratios are computed in SQL; net profit is
+        # realized PnL from trades (not balance difference)
         cursor.execute('''
             SELECT
-                id, name, api_key, api_secret, is_testnet, created_at,
-                total_trades, total_pnl, total_commission,
-                winning_trades, losing_trades, last_sync_time,
-                current_balance, starting_balance, avg_win, avg_loss,
-                largest_win, largest_loss, profit_factor, total_volume
+                id, name,
+                CASE WHEN api_key != '' THEN substr(api_key, 1, 8) || '...' ELSE '' END as api_key,
+                api_key as api_key_full, api_secret, is_testnet, created_at,
+                COALESCE(total_trades, 0) as total_trades,
+                total_pnl, total_commission,
+                COALESCE(winning_trades, 0) as winning_trades,
+                COALESCE(losing_trades, 0) as losing_trades,
+                CASE WHEN COALESCE(winning_trades, 0) + COALESCE(losing_trades, 0) > 0
+                     THEN CAST(COALESCE(winning_trades, 0) AS REAL)
+                          / (COALESCE(winning_trades, 0) + COALESCE(losing_trades, 0)) * 100
+                     ELSE 0 END as win_rate,
+                last_sync_time, current_balance, starting_balance,
+                total_pnl as net_profit,
+                CASE WHEN starting_balance > 0
+                     THEN COALESCE(total_pnl, 0) / starting_balance * 100
+                     ELSE 0 END as net_profit_pct,
+                avg_win, avg_loss, largest_win, largest_loss, profit_factor, total_volume
             FROM accounts
             ORDER BY created_at DESC
         ''')
 
-        accounts = []
-        for row in cursor.fetchall():
-            total_trades = row['total_trades'] or 0
-            winning = row['winning_trades'] or 0
-            losing = row['losing_trades'] or 0
-            win_rate = round(winning / (winning + losing) * 100, 1) if (winning + losing) > 0 else 0
-            
-            current_balance = row['current_balance'] or 0
-            starting_balance = row['starting_balance'] or 0
-            # Net profit is realized PnL from trades (not balance difference)
-            net_profit = row['total_pnl'] or 0
-            net_profit_pct = round((net_profit / starting_balance) * 100, 2) if starting_balance > 0 else 0
-
-            accounts.append({
-                'id': row['id'],
-                'name': row['name'],
-                'api_key': row['api_key'][:8] + '...' if row['api_key'] else '',  # Mask key
-                'api_key_full': row['api_key'],
-                'api_secret': row['api_secret'],
-                'is_testnet': bool(row['is_testnet']),
-                'created_at': row['created_at'],
-                'total_trades': total_trades,
-                'total_pnl': round(row['total_pnl'] or 0, 2),
-                'total_commission': round(row['total_commission'] or 0, 2),
-                'winning_trades': winning,
-                'losing_trades': losing,
-                'win_rate': win_rate,
-                'last_sync_time': row['last_sync_time'],
-                'current_balance': round(current_balance, 2),
-                'starting_balance': round(starting_balance, 2),
-                'net_profit': round(net_profit, 2),
-                'net_profit_pct': net_profit_pct,
-                'avg_win': round(row['avg_win'] or 0, 2),
-                'avg_loss': round(row['avg_loss'] or 0, 2),
-                'largest_win': round(row['largest_win'] or 0, 2),
-                'largest_loss': round(row['largest_loss'] or 0, 2),
-                'profit_factor': round(row['profit_factor'] or 0, 2),
-                'total_volume': round(row['total_volume'] or 0, 2)
-            })
+        accounts = [dict(row) for row in cursor]
+        for account in accounts:
+            account['is_testnet'] = bool(account['is_testnet'])
+            # Python's round(), not SQLite's ROUND(): the two disagree on some half-way values
+            for key in _ACCOUNT_MONEY_FIELDS:
+                account[key] = round(account[key] or 0, 2)
+            account['win_rate'] = round(account['win_rate'], 1)
+            account['net_profit_pct'] = round(account['net_profit_pct'], 2)
 
-        conn.close()
         return accounts
 
 
 def get_account(account_id):
     """Get a single account by ID."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
         
         cursor.execute('SELECT * FROM accounts WHERE id = ?', (account_id,))
         row = cursor.fetchone()
         
-        conn.close()
-        
         if row:
             return {
                 'id': row['id'],
@@ -565,149 +969,134 @@ def get_account(account_id):
         return None
 
 
+# Fixed statement for update_account(); a NULL parameter keeps the column's current value
+_SQL_UPDATE_ACCOUNT = '''
+    UPDATE accounts SET
+        name = COALESCE(?, name),
+        api_key = COALESCE(?, api_key),
+        api_secret = COALESCE(?, api_secret),
+        is_testnet = COALESCE(?, is_testnet)
+    WHERE id = ?
+'''
+
+
 def update_account(account_id, name=None, api_key=None, api_secret=None, is_testnet=None):
     """Update an account."""
-    with db_lock:
-        conn = get_connection()
+    if name is None and api_key is None and api_secret is None and is_testnet is None:
+        return True
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if name is not None:
-            updates.append('name = ?')
-            params.append(name)
-        if api_key is not None:
-            updates.append('api_key = ?')
-            params.append(api_key)
-        if api_secret is not None:
-            updates.append('api_secret = ?')
-            params.append(api_secret)
-        if is_testnet is not None:
-            updates.append('is_testnet = ?')
-            params.append(1 if is_testnet else 0)
-        
-        if updates:
-            params.append(account_id)
-            cursor.execute(f'UPDATE accounts SET {", ".join(updates)} WHERE id = ?', params)
-        
+
+        cursor.execute(_SQL_UPDATE_ACCOUNT, (
+            name, api_key, api_secret,
+            None if is_testnet is None else (1 if is_testnet else 0),
+            account_id
+        ))
+
         conn.commit()
-        conn.close()
         return True
 
 
+# Aggregates over trades t, one row per account; COALESCE covers accounts with no trades
+_ACCOUNT_TRADE_AGGREGATES = '''
+        COUNT(t.id) as total_trades,
+        COALESCE(SUM(t.realized_pnl), 0) as total_pnl,
+        COALESCE(SUM(t.commission), 0) as total_commission,
+        COALESCE(SUM(t.quantity * t.price), 0) as total_volume,
+        COALESCE(SUM(t.realized_pnl > 0), 0) as winning_trades,
+        COALESCE(SUM(t.realized_pnl < 0), 0) as losing_trades,
+        COALESCE(AVG(CASE WHEN t.realized_pnl > 0 THEN t.realized_pnl END), 0) as avg_win,
+        COALESCE(AVG(CASE WHEN t.realized_pnl < 0 THEN t.realized_pnl END), 0) as avg_loss,
+        COALESCE(MAX(t.realized_pnl), 0) as largest_win,
+        COALESCE(MIN(t.realized_pnl), 0) as largest_loss,
+        COALESCE(SUM(MAX(t.realized_pnl, 0)), 0) as gross_profit,
+        COALESCE(-SUM(MIN(t.realized_pnl, 0)), 0) as gross_loss
+'''
+# Writes the aggregates from subquery s onto its account in one statement. ?1 is an optional
+# current balance, which also seeds starting_balance while that is still unset
+_SQL_UPDATE_ACCOUNT_STATS = '''
+    UPDATE accounts SET
+        total_trades = s.total_trades,
+        total_pnl = ROUND(s.total_pnl, 4),
+        total_commission = ROUND(s.total_commission, 4),
+        total_volume = ROUND(s.total_volume, 2),
+        winning_trades = s.winning_trades,
+        losing_trades = s.losing_trades,
+        avg_win = ROUND(s.avg_win, 4),
+        avg_loss = ROUND(s.avg_loss, 4),
+        largest_win = ROUND(s.largest_win, 4),
+        largest_loss = ROUND(s.largest_loss, 4),
+        profit_factor = CASE
+            WHEN s.gross_loss > 0 THEN ROUND(s.gross_profit / s.gross_loss, 2)
+            WHEN s.gross_profit > 0 THEN 999.99
+            ELSE 0
+        END,
+        last_sync_time = CURRENT_TIMESTAMP,
+        current_balance = COALESCE(?1, current_balance),
+        starting_balance = CASE
+            WHEN ?1 IS NOT NULL AND COALESCE(starting_balance, 0) = 0 THEN ?1
+            ELSE starting_balance
+        END
+    FROM ({source}) s
+    WHERE accounts.id = s.account_id
+'''
+_SQL_UPDATE_ONE_ACCOUNT_STATS = _SQL_UPDATE_ACCOUNT_STATS.format(
+    source=f'SELECT ?2 as account_id, {_ACCOUNT_TRADE_AGGREGATES} FROM trades t WHERE t.account_id = ?2'
+)
+_SQL_UPDATE_ALL_ACCOUNT_STATS = _SQL_UPDATE_ACCOUNT_STATS.format(
+    source=f'''
+        SELECT a.id as account_id, {_ACCOUNT_TRADE_AGGREGATES}
+        FROM accounts a LEFT JOIN trades t ON t.account_id = a.id
+        GROUP BY a.id
+    '''
+)
+
+
 def update_account_stats(account_id, current_balance=None):
     """Recalculate and update account stats from trades table."""
-    with db_lock:
-        conn = get_connection()
+    if current_balance is not None:
+        current_balance = round(current_balance, 2)
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
-        # Calculate comprehensive stats from trades
-        cursor.execute('''
-            SELECT
-                COUNT(*) as total_trades,
-                COALESCE(SUM(realized_pnl), 0) as total_pnl,
-                COALESCE(SUM(commission), 0) as total_commission,
-                COALESCE(SUM(quantity * price), 0) as total_volume,
-                SUM(CASE WHEN realized_pnl > 0 THEN 1 ELSE 0 END) as winning_trades,
-                SUM(CASE WHEN realized_pnl < 0 THEN 1 ELSE 0 END) as losing_trades,
-                COALESCE(AVG(CASE WHEN realized_pnl > 0 THEN realized_pnl END), 0) as avg_win,
-                COALESCE(AVG(CASE WHEN realized_pnl < 0 THEN realized_pnl END), 0) as avg_loss,
-                COALESCE(MAX(realized_pnl), 0) as largest_win,
-                COALESCE(MIN(realized_pnl), 0) as largest_loss,
-                COALESCE(SUM(CASE WHEN realized_pnl > 0 THEN realized_pnl ELSE 0 END), 0) as gross_profit,
-                COALESCE(ABS(SUM(CASE WHEN realized_pnl < 0 THEN realized_pnl ELSE 0 END)), 0) as gross_loss
-            FROM trades
-            WHERE account_id = ?
-        ''', (account_id,))
+        cursor.execute(_SQL_UPDATE_ONE_ACCOUNT_STATS, (current_balance, account_id))
 
-        row = cursor.fetchone()
+        conn.commit()
+        return True
 
-        if row:
-            # Calculate profit factor (gross profit / gross loss)
-            gross_profit = row['gross_profit'] or 0
-            gross_loss = row['gross_loss'] or 0
-            profit_factor = round(gross_profit / gross_loss, 2) if gross_loss > 0 else (999.99 if gross_profit > 0 else 0)
-            
-            # Build update query
-            update_fields = '''
-                total_trades = ?,
-                total_pnl = ?,
-                total_commission = ?,
-                total_volume = ?,
-                winning_trades = ?,
-                losing_trades = ?,
-                avg_win = ?,
-                avg_loss = ?,
-                largest_win = ?,
-                largest_loss = ?,
-                profit_factor = ?,
-                last_sync_time = CURRENT_TIMESTAMP
-            '''
-            params = [
-                row['total_trades'] or 0,
-                round(row['total_pnl'] or 0, 4),
-                round(row['total_commission'] or 0, 4),
-                round(row['total_volume'] or 0, 2),
-                row['winning_trades'] or 0,
-                row['losing_trades'] or 0,
-                round(row['avg_win'] or 0, 4),
-                round(row['avg_loss'] or 0, 4),
-                round(row['largest_win'] or 0, 4),
-                round(row['largest_loss'] or 0, 4),
-                profit_factor
-            ]
-            
-            # Also update current balance if provided
-            if current_balance is not None:
-                update_fields += ', current_balance = ?'
-                params.append(round(current_balance, 2))
-                
-                # Set starting balance if not set yet
-                cursor.execute('SELECT starting_balance FROM accounts WHERE id = ?', (account_id,))
-                acc_row = cursor.fetchone()
-                if acc_row and (acc_row['starting_balance'] is None or acc_row['starting_balance'] == 0):
-                    update_fields += ', starting_balance = ?'
-                    params.append(round(current_balance, 2))
-            
-            params.append(account_id)
-            cursor.execute(f'UPDATE accounts SET {update_fields} WHERE id = ?', params)
+
+def recompute_all_account_stats():
+    """Recalculate stats for every account with one grouped pass over the trades table."""
+    with get_connection(write=True) as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(_SQL_UPDATE_ALL_ACCOUNT_STATS, (None,))
+        updated = cursor.rowcount
 
         conn.commit()
-        conn.close()
-        return True
+        return updated
 
 
 def update_account_balance(account_id, balance):
     """Update just the current balance for an account."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
         
-        # Check if starting balance is set
-        cursor.execute('SELECT starting_balance FROM accounts WHERE id = ?', (account_id,))
-        row = cursor.fetchone()
-        
-        if row and (row['starting_balance'] is None or row['starting_balance'] == 0):
-            # Set both starting and current balance
-            cursor.execute('''
-                UPDATE accounts SET current_balance = ?, starting_balance = ? WHERE id = ?
-            ''', (round(balance, 2), round(balance, 2), account_id))
-        else:
-            # Only update current balance
-            cursor.execute('''
-                UPDATE accounts SET current_balance = ? WHERE id = ?
-            ''', (round(balance, 2), account_id))
+        # Starting balance is only filled in when it hasn't been set yet
+        cursor.execute('''
+            UPDATE accounts
+            SET current_balance = ?1,
+                starting_balance = CASE WHEN COALESCE(starting_balance, 0) = 0 THEN ?1 ELSE starting_balance END
+            WHERE id = ?2
+        ''', (round(balance, 2), account_id))
         
         conn.commit()
-        conn.close()
         return True
 
 
 def set_starting_balance(account_id, balance):
     """Manually set the starting balance for an account."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -715,65 +1104,126 @@ def set_starting_balance(account_id, balance):
         ''', (round(balance, 2), account_id))
         
         conn.commit()
-        conn.close()
         return True
 
 
 def delete_account(account_id):
     """Delete an account and all its trades."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM accounts WHERE id = ?', (account_id,))
         deleted = cursor.rowcount > 0
         
         conn.commit()
-        conn.close()
+        _invalidate_closed_positions_stats(account_id)
         return deleted
 
 
 # ==================== TRADE OPERATIONS ====================
 
+# Hot-path statements kept as constants so every call reuses the connection's prepared statement
+# OR IGNORE: the unique exchange_trade_id index skips trades already stored
+_SQL_INSERT_TRADE = '''
+    INSERT OR IGNORE INTO trades (
+        account_id, exchange_trade_id, order_id, symbol, side, quantity,
+        price, realized_pnl, commission, commission_asset, trade_time
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+_SQL_GET_TRADES_BASE = '''
+    SELECT t.*, a.name as account_name
+    FROM trades t
+    JOIN accounts a ON t.account_id = a.id
+    WHERE 1=1
+'''
+
+
 def insert_trade(account_id, exchange_trade_id, order_id, symbol, side, quantity,
                  price, realized_pnl, commission, commission_asset, trade_time):
     """Insert a trade if it doesn't already exist. Returns True if inserted."""
-    with db_lock:
-        conn = get_connection()
-        try:
-            cursor = conn.cursor()
+    with get_connection(write=True) as conn:
+        cursor = conn.cursor()
 
-            # Check if trade already exists
-            cursor.execute('SELECT id FROM trades WHERE exchange_trade_id = ?', (str(exchange_trade_id),))
-            if cursor.fetchone():
-                return False  # Already exists
+        cursor.execute(_SQL_INSERT_TRADE, (
+            account_id, str(exchange_trade_id), str(order_id), symbol, side, quantity,
+            price, realized_pnl, commission, commission_asset, trade_time
+        ))
+        inserted = cursor.rowcount > 0
 
-            cursor.execute('''
-                INSERT INTO trades (
-                    account_id, exchange_trade_id, order_id, symbol, side, quantity,
-                    price, realized_pnl, commission, commission_asset, trade_time
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (account_id, str(exchange_trade_id), str(order_id), symbol, side, quantity,
-                  price, realized_pnl, commission, commission_asset, trade_time))
-
-            conn.commit()
-            return True
-        finally:
-            conn.close()
+        conn.commit()
+        return inserted
 
 
-def get_trades(account_id=None, symbol=None, limit=100, offset=0):
-    """Get trades with optional filters."""
-    with db_lock:
-        conn = get_connection()
+# Batches at least this large (and at least as large as the table) load without secondary indexes
+BULK_INSERT_INDEX_THRESHOLD = 1000
+
+
+@contextmanager
+def _bulk_insert_context(cursor):
+    """
+    Drop the non-unique trade indexes for the duration of a bulk load and rebuild them
+    afterwards, so each is built with one sorted pass instead of a B-tree insert per row.
+    Must run inside a transaction: if the load fails, the rollback restores the indexes.
+    """
+    for name, _ in _TRADES_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    # No try/finally on purpose: DDL after a failed load would run in a transaction the
+    # caller is about to roll back, and that rollback brings the indexes back by itself
+    yield
+    for _, sql in _TRADES_INDEXES:
+        cursor.execute(sql)
+
+
+def insert_trades_bulk(account_id, trades):
+    """
+    Insert many trades for an account in a single transaction.
+    Each trade is (exchange_trade_id, order_id, symbol, side, quantity, price,
+    realized_pnl, commission, commission_asset, trade_time). Trades already stored
+    (same exchange_trade_id) are skipped by the unique index. Returns the number inserted.
+    """
+    trades = list(trades)
+    if not trades:
+        # Nothing new since the last sync; don't take the write lock for an empty commit
+        return 0
+    with get_connection(write=True) as conn:
+        cursor = conn.cursor()
+
+        _begin_immediate(cursor)
+        rows = (
+            (account_id, str(exchange_trade_id), str(order_id), symbol, side, quantity,
+             price, realized_pnl, commission, commission_asset, trade_time)
+            for exchange_trade_id, order_id, symbol, side, quantity, price,
+                realized_pnl, commission, commission_asset, trade_time in trades
+        )
+        rebuild = False
+        if len(trades) >= BULK_INSERT_INDEX_THRESHOLD:
+            # Rebuilding only pays off when the batch is comparable to the existing table,
+            # e.g. the initial sync of a new account; MAX(id) is a cheap size estimate
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM trades')
+            rebuild = len(trades) >= cursor.fetchone()[0]
+        with _bulk_insert_context(cursor) if rebuild else nullcontext():
+            cursor.executemany(_SQL_INSERT_TRADE, rows)
+            inserted = max(cursor.rowcount, 0)
+        if inserted >= BULK_INSERT_INDEX_THRESHOLD:
+            # Keep the planner's row estimates in step with a large load
+            cursor.execute('ANALYZE trades')
+
+        conn.commit()
+        return inserted
+
+
+def get_trades(account_id=None, symbol=None, limit=100, offset=0, before=None):
+    """Get trades with optional filters, newest first; trades without a trade_time come last.
+
+    Pass before=(trade_time, id) of the last row already shown to fetch the next page by
+    keyset, which seeks the (account_id, trade_time) indexes instead of scanning and
+    discarding offset rows. Use '' as trade_time when that row has none. offset is
+    deprecated and only applies without before.
+    """
+    with get_connection() as conn:
         cursor = conn.cursor()
         
-        query = '''
-            SELECT t.*, a.name as account_name
-            FROM trades t
-            JOIN accounts a ON t.account_id = a.id
-            WHERE 1=1
-        '''
+        query = _SQL_GET_TRADES_BASE
         params = []
         
         if account_id:
@@ -783,25 +1233,42 @@ def get_trades(account_id=None, symbol=None, limit=100, offset=0):
         if symbol:
             query += ' AND t.symbol = ?'
             params.append(symbol)
-        
-        query += ' ORDER BY t.trade_time DESC LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
-        
-        cursor.execute(query, params)
-        
+
+        if before is None:
+            cursor.execute(query + ' ORDER BY t.trade_time DESC, t.id LIMIT ? OFFSET ?',
+                           params + [limit, offset])
+            return [dict(row) for row in cursor]
+
+        before_time, before_id = before
         trades = []
-        for row in cursor.fetchall():
-            trade = dict(row)
-            trades.append(trade)
-        
-        conn.close()
+        if before_time:
+            # id breaks trade_time ties so keyset pages neither skip nor repeat rows. It ascends
+            # because that is the rowid order inside the trade_time DESC indexes, and the plain
+            # trade_time bound gives the planner a range to seek on
+            cursor.execute(
+                query + ' AND t.trade_time <= ? AND (t.trade_time < ? OR t.id > ?)'
+                        ' ORDER BY t.trade_time DESC, t.id LIMIT ?',
+                params + [before_time, before_time, before_id, limit]
+            )
+            trades = [dict(row) for row in cursor]
+
+        # NULL sorts after every trade_time but never satisfies the range above, so undated
+        # trades are paged on their own, by id, once the dated ones run out
+        if len(trades) < limit:
+            if before_time:
+                query += ' AND t.trade_time IS NULL'
+            else:
+                query += ' AND t.trade_time IS NULL AND t.id > ?'
+                params.append(before_id)
+            cursor.execute(query + ' ORDER BY t.id LIMIT ?', params + [limit - len(trades)])
+            trades.extend(dict(row) for row in cursor)
+
         return trades
 
 
 def get_trades_count(account_id=None, symbol=None):
     """Get total count of trades for pagination."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         query = 'SELECT COUNT(*) as count FROM trades WHERE 1=1'
@@ -817,46 +1284,49 @@ def get_trades_count(account_id=None, symbol=None):
 
         cursor.execute(query, params)
         row = cursor.fetchone()
-        conn.close()
 
         return row['count'] if row else 0
 
 
+# Aggregate statistics over all trades
+_SQL_TRADE_STATS = '''
+    SELECT 
+        COUNT(*) as total_trades,
+        COUNT(DISTINCT symbol) as symbols_traded,
+        COALESCE(SUM(realized_pnl), 0) as total_pnl,
+        COALESCE(SUM(commission), 0) as total_commission,
+        COALESCE(SUM(quantity * price), 0) as total_volume,
+        SUM(CASE WHEN realized_pnl > 0 THEN 1 ELSE 0 END) as winning_trades,
+        SUM(CASE WHEN realized_pnl < 0 THEN 1 ELSE 0 END) as losing_trades,
+        SUM(CASE WHEN realized_pnl = 0 THEN 1 ELSE 0 END) as breakeven_trades,
+        COALESCE(AVG(CASE WHEN realized_pnl > 0 THEN realized_pnl END), 0) as avg_win,
+        COALESCE(AVG(CASE WHEN realized_pnl < 0 THEN realized_pnl END), 0) as avg_loss,
+        COALESCE(MAX(realized_pnl), 0) as largest_win,
+        COALESCE(MIN(realized_pnl), 0) as largest_loss,
+        COALESCE(SUM(CASE WHEN realized_pnl > 0 THEN realized_pnl ELSE 0 END), 0) as gross_profit,
+        COALESCE(ABS(SUM(CASE WHEN realized_pnl < 0 THEN realized_pnl ELSE 0 END)), 0) as gross_loss
+    FROM trades
+'''
+# The same for one account (?1), picking up the account balances in the same statement
+_SQL_ACCOUNT_TRADE_STATS = f'''
+    SELECT s.*, a.id AS balance_account_id, a.current_balance, a.starting_balance
+    FROM ({_SQL_TRADE_STATS} WHERE account_id = ?1) s
+    LEFT JOIN accounts a ON a.id = ?1
+'''
+
+
 def get_trade_stats(account_id=None):
     """Get aggregated trade statistics."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
         
-        query = '''
-            SELECT 
-                COUNT(*) as total_trades,
-                COUNT(DISTINCT symbol) as symbols_traded,
-                COALESCE(SUM(realized_pnl), 0) as total_pnl,
-                COALESCE(SUM(commission), 0) as total_commission,
-                COALESCE(SUM(quantity * price), 0) as total_volume,
-                SUM(CASE WHEN realized_pnl > 0 THEN 1 ELSE 0 END) as winning_trades,
-                SUM(CASE WHEN realized_pnl < 0 THEN 1 ELSE 0 END) as losing_trades,
-                SUM(CASE WHEN realized_pnl = 0 THEN 1 ELSE 0 END) as breakeven_trades,
-                COALESCE(AVG(CASE WHEN realized_pnl > 0 THEN realized_pnl END), 0) as avg_win,
-                COALESCE(AVG(CASE WHEN realized_pnl < 0 THEN realized_pnl END), 0) as avg_loss,
-                COALESCE(MAX(realized_pnl), 0) as largest_win,
-                COALESCE(MIN(realized_pnl), 0) as largest_loss,
-                COALESCE(SUM(CASE WHEN realized_pnl > 0 THEN realized_pnl ELSE 0 END), 0) as gross_profit,
-                COALESCE(ABS(SUM(CASE WHEN realized_pnl < 0 THEN realized_pnl ELSE 0 END)), 0) as gross_loss
-            FROM trades
-        '''
-        
         if account_id:
-            query += ' WHERE account_id = ?'
-            cursor.execute(query, (account_id,))
+            cursor.execute(_SQL_ACCOUNT_TRADE_STATS, (account_id,))
         else:
-            cursor.execute(query)
+            cursor.execute(_SQL_TRADE_STATS)
         
         row = cursor.fetchone()
         
-        conn.close()
-        
         if row:
             total = row['total_trades'] or 0
             winning = row['winning_trades'] or 0
@@ -887,17 +1357,9 @@ def get_trade_stats(account_id=None):
             
             # Add account balance info if account_id specified
             if account_id:
-                conn2 = get_connection()
-                cursor2 = conn2.cursor()
-                cursor2.execute('''
-                    SELECT current_balance, starting_balance FROM accounts WHERE id = ?
-                ''', (account_id,))
-                acc_row = cursor2.fetchone()
-                conn2.close()
-                
-                if acc_row:
-                    current_balance = acc_row['current_balance'] or 0
-                    starting_balance = acc_row['starting_balance'] or 0
+                if row['balance_account_id'] is not None:
+                    current_balance = row['current_balance'] or 0
+                    starting_balance = row['starting_balance'] or 0
                     stats['current_balance'] = round(current_balance, 2)
                     stats['starting_balance'] = round(starting_balance, 2)
                     stats['net_profit'] = round(total_pnl, 2)
@@ -910,29 +1372,45 @@ def get_trade_stats(account_id=None):
 
 def delete_trade(trade_id):
     """Delete a trade."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM trades WHERE id = ?', (trade_id,))
         deleted = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return deleted
 
 
 def delete_all_trades_and_positions():
     """Delete all trades and closed positions from database. Used for fresh start."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
-        cursor.execute('DELETE FROM trades')
-        trades_deleted = cursor.rowcount
+        _begin_immediate(cursor)
+        cursor.execute('SELECT COUNT(*) FROM trades')
+        trades_deleted = cursor.fetchone()[0]
+        cursor.execute('SELECT COUNT(*) FROM closed_positions')
+        positions_deleted = cursor.fetchone()[0]
 
-        cursor.execute('DELETE FROM closed_positions')
-        positions_deleted = cursor.rowcount
+        # Dropping and recreating is O(1) in the row count, where DELETE would
+        # remove every row and index entry one at a time. DROP also discards the
+        # AUTOINCREMENT counters, so carry them over to keep ids from being reused
+        cursor.execute(
+            "SELECT name, seq FROM sqlite_sequence WHERE name IN ('trades', 'closed_positions')"
+        )
+        sequences = cursor.fetchall()
+        cursor.execute('DROP TABLE trades')
+        cursor.execute('DROP TABLE closed_positions')
+        cursor.execute(_TRADES_DDL)
+        cursor.execute(_CLOSED_POSITIONS_DDL)
+        for _, sql in _TRADES_INDEXES:
+            cursor.execute(sql)
+        for sql in _CLOSED_POSITIONS_INDEXES + _CLOSED_POSITIONS_TRIGGERS:
+            cursor.execute(sql)
+        cursor.executemany('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+                           [tuple(row) for row in sequences])
+        cursor.execute('DELETE FROM closed_positions_summary')
 
         # Reset account stats
         cursor.execute('''
@@ -952,17 +1430,18 @@ def delete_all_trades_and_positions():
         ''')
 
         conn.commit()
-        conn.close()
+        _invalidate_closed_positions_stats()
         print(f"Deleted {trades_deleted} trades and {positions_deleted} closed positions")
         return trades_deleted, positions_deleted
 
 
 def delete_account_trades(account_id):
     """Delete all trades and closed positions for a specific account."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        _begin_immediate(cursor)
+
         cursor.execute('DELETE FROM trades WHERE account_id = ?', (account_id,))
         trades_deleted = cursor.rowcount
 
@@ -988,15 +1467,14 @@ def delete_account_trades(account_id):
         ''', (account_id,))
 
         conn.commit()
-        conn.close()
+        _invalidate_closed_positions_stats(account_id)
         print(f"Deleted {trades_deleted} trades and {positions_deleted} closed positions for account {account_id}")
         return trades_deleted, positions_deleted
 
 
 def get_last_sync_time(account_id):
     """Get the most recent trade time for an account."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -1006,7 +1484,6 @@ def get_last_sync_time(account_id):
         ''', (account_id,))
         
         row = cursor.fetchone()
-        conn.close()
         
         if row and row['last_time']:
             return row['last_time']
@@ -1015,33 +1492,88 @@ def get_last_sync_time(account_id):
 
 # ==================== USER AUTHENTICATION ====================
 
+# scrypt cost parameters (memory-hard: 128 * n * r bytes = 16 MB per hash)
+SCRYPT_N = 16384
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_PREFIX = 'scrypt$'
+ARGON2_PREFIX = '$argon2'
+
+
 def hash_password(password, salt=None):
-    """Hash a password with salt."""
+    """Hash a password with salt using scrypt."""
     if salt is None:
         salt = secrets.token_hex(32)
-    password_hash = hashlib.pbkdf2_hmac(
+    password_hash = SCRYPT_PREFIX + hashlib.scrypt(
+        password.encode('utf-8'),
+        salt=salt.encode('utf-8'),
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
+        dklen=32
+    ).hex()
+    return password_hash, salt
+
+
+def _legacy_hash_password(password, salt):
+    """Hash a password the old way (PBKDF2-SHA256, 100k iterations) for pre-scrypt users."""
+    return hashlib.pbkdf2_hmac(
         'sha256',
         password.encode('utf-8'),
         salt.encode('utf-8'),
         100000
     ).hex()
-    return password_hash, salt
+
+
+def _new_password_hash(password):
+    """
+    Hash a password with the preferred scheme. Returns (password_hash, salt); argon2 hashes
+    carry their own salt, so the salt column is left empty for them.
+    """
+    if _argon2 is not None:
+        return _argon2.hash(password), ''
+    return hash_password(password)
+
+
+def _check_password(password, stored_hash, salt):
+    """
+    Check a password against a stored hash in any of the supported formats.
+    Returns (matches, needs_rehash), where needs_rehash means the hash should be upgraded.
+    """
+    if stored_hash.startswith(ARGON2_PREFIX):
+        if _argon2 is None:
+            print("Warning: argon2-cffi is not installed; cannot verify argon2 password hashes")
+            return False, False
+        try:
+            _argon2.verify(stored_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False, False
+        return True, _argon2.check_needs_rehash(stored_hash)
+
+    if stored_hash.startswith(SCRYPT_PREFIX):
+        matches = hmac.compare_digest(hash_password(password, salt)[0], stored_hash)
+        return matches, matches and _argon2 is not None
+
+    # Pre-scrypt PBKDF2 hash: always upgrade once it has matched
+    matches = hmac.compare_digest(_legacy_hash_password(password, salt), stored_hash)
+    return matches, matches
 
 
 def create_user(username, password):
     """Create a new user. Returns user id or None if username exists."""
-    with db_lock:
-        conn = get_connection()
+    # Hash before taking the write lock so other writers don't wait on the KDF
+    password_hash, salt = _new_password_hash(password)
+
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        _begin_immediate(cursor)
+
         # Check if username exists
         cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
         if cursor.fetchone():
-            conn.close()
             return None
 
-        password_hash, salt = hash_password(password)
-
         cursor.execute(
             'INSERT INTO users (username, password_hash, salt) VALUES (?, ?, ?)',
             (username, password_hash, salt)
@@ -1049,67 +1581,109 @@ def create_user(username, password):
         user_id = cursor.lastrowid
 
         conn.commit()
-        conn.close()
+        _invalidate_user_count()
         return user_id
 
 
 def verify_user(username, password):
     """Verify user credentials. Returns user dict or None."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
+        cursor.execute(
+            'SELECT id, username, password_hash, salt, created_at FROM users WHERE username = ?',
+            (username,)
+        )
         row = cursor.fetchone()
-        conn.close()
 
         if not row:
             return None
 
-        password_hash, _ = hash_password(password, row['salt'])
+        matches, needs_rehash = _check_password(password, row['password_hash'], row['salt'])
+        if not matches:
+            return None
 
-        if password_hash == row['password_hash']:
-            return {
-                'id': row['id'],
-                'username': row['username'],
-                'created_at': row['created_at']
-            }
-        return None
+        if needs_rehash:
+            # Upgrade to the preferred scheme now that we have the plaintext
+            password_hash, salt = _new_password_hash(password)
+            with get_connection(write=True) as write_conn:
+                write_conn.execute(
+                    'UPDATE users SET password_hash = ?, salt = ? WHERE id = ?',
+                    (password_hash, salt, row['id'])
+                )
+
+        return {
+            'id': row['id'],
+            'username': row['username'],
+            'created_at': row['created_at']
+        }
+
+
+# Cached (count, expires_at) for get_user_count(); create_user() invalidates it and the
+# TTL bounds staleness if another process registers a user
+USER_COUNT_CACHE_TTL = 30  # seconds
+_user_count_cache = [None]
+_user_count_cache_lock = Lock()
+_user_count_generation = 0
+
+
+def _invalidate_user_count():
+    """Drop the cached user count."""
+    global _user_count_generation
+    with _user_count_cache_lock:
+        _user_count_generation += 1
+        _user_count_cache[0] = None
 
 
 def get_user_count():
     """Get the number of registered users."""
-    with db_lock:
-        conn = get_connection()
+    now = time.monotonic()
+    with _user_count_cache_lock:
+        cached = _user_count_cache[0]
+        generation = _user_count_generation
+    if cached is not None and cached[1] > now:
+        return cached[0]
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT COUNT(*) as count FROM users')
         row = cursor.fetchone()
-        conn.close()
-        return row['count'] if row else 0
+        count = row['count'] if row else 0
+    with _user_count_cache_lock:
+        # Skip storing if a new user was created while we were counting
+        if generation == _user_count_generation:
+            _user_count_cache[0] = (count, now + USER_COUNT_CACHE_TTL)
+    return count
+
+
+# Cached (is_open, expires_at) for is_registration_open(); written through by set_registration_open()
+_registration_open_cache = [None]
 
 
 def is_registration_open():
     """Check if registration is open."""
-    with db_lock:
-        conn = get_connection()
+    cached = _registration_open_cache[0]
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT value FROM app_settings WHERE key = ?', ('registration_open',))
         row = cursor.fetchone()
-        conn.close()
-        return row['value'] == 'true' if row else True
+        is_open = row['value'] == 'true' if row else True
+    _registration_open_cache[0] = (is_open, time.monotonic() + SETTINGS_CACHE_TTL)
+    return is_open
 
 
 def set_registration_open(is_open):
     """Set registration open/closed."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute(
-            'INSERT OR REPLACE INTO app_settings (key, value) VALUES (?, ?)',
+            'INSERT INTO app_settings (key, value) VALUES (?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value',
             ('registration_open', 'true' if is_open else 'false')
         )
         conn.commit()
-        conn.close()
+        _registration_open_cache[0] = (bool(is_open), time.monotonic() + SETTINGS_CACHE_TTL)
         return True
 
 
@@ -1117,12 +1691,10 @@ def set_registration_open(is_open):
 
 def get_positions_cache_time():
     """Get the last update time for positions cache."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('SELECT value FROM cache_meta WHERE key = ?', ('positions_updated',))
         row = cursor.fetchone()
-        conn.close()
         if row:
             try:
                 return float(row['value'])
@@ -1131,202 +1703,242 @@ def get_positions_cache_time():
         return None
 
 
+_SQL_SET_POSITIONS_CACHE_TIME = (
+    "INSERT INTO cache_meta (key, value, updated_at) VALUES ('positions_updated', ?, CURRENT_TIMESTAMP) "
+    'ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at'
+)
+
+
 def set_positions_cache_time(timestamp):
     """Set the last update time for positions cache."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            'INSERT OR REPLACE INTO cache_meta (key, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
-            ('positions_updated', str(timestamp))
-        )
+        cursor.execute(_SQL_SET_POSITIONS_CACHE_TIME, (str(timestamp),))
         conn.commit()
-        conn.close()
 
 
-def save_open_positions(positions):
-    """Save open positions to database (replaces all existing)."""
-    with db_lock:
-        conn = get_connection()
+# Upsert on the UNIQUE(account_id, symbol) key, so positions that are still open keep
+# their row and are rewritten in place
+_SQL_INSERT_OPEN_POSITION = '''
+    INSERT INTO open_positions
+    (account_id, symbol, side, quantity, entry_price, mark_price,
+     unrealized_pnl, leverage, stop_price, stop_order_id, stop_type, tp_price, tp_order_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(account_id, symbol) DO UPDATE SET
+        side = excluded.side,
+        quantity = excluded.quantity,
+        entry_price = excluded.entry_price,
+        mark_price = excluded.mark_price,
+        unrealized_pnl = excluded.unrealized_pnl,
+        leverage = excluded.leverage,
+        stop_price = excluded.stop_price,
+        stop_order_id = excluded.stop_order_id,
+        stop_type = excluded.stop_type,
+        tp_price = excluded.tp_price,
+        tp_order_id = excluded.tp_order_id,
+        updated_at = CURRENT_TIMESTAMP
+'''
+# Removes positions missing from the saved batch, passed as a JSON array of [account_id, symbol]
+_SQL_DELETE_STALE_OPEN_POSITIONS = '''
+    DELETE FROM open_positions
+    WHERE NOT EXISTS (
+        SELECT 1 FROM json_each(?) j
+        WHERE json_extract(j.value, '$[0]') = open_positions.account_id
+          AND json_extract(j.value, '$[1]') = open_positions.symbol
+    )
+'''
+
+# Builds the _SQL_INSERT_OPEN_POSITION parameter tuple from a position dict in one call
+_open_position_row = itemgetter(
+    'account_id', 'symbol', 'side', 'quantity', 'entry_price', 'mark_price',
+    'unrealized_pnl', 'leverage', 'stop_price', 'stop_order_id', 'stop_type',
+    'tp_price', 'tp_order_id'
+)
+# Protection orders are optional on a position
+_OPEN_POSITION_DEFAULTS = dict.fromkeys(
+    ('stop_price', 'stop_order_id', 'stop_type', 'tp_price', 'tp_order_id')
+)
+
+
+def save_open_positions(positions, timestamp=None):
+    """
+    Save open positions to database (replaces all existing).
+    If timestamp is given, the positions cache time is stamped in the same transaction.
+    """
+    rows = [_open_position_row({**_OPEN_POSITION_DEFAULTS, **pos}) for pos in positions]
+    keys = _json_dumps([row[:2] for row in rows])
+
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
-        # Clear existing positions
-        cursor.execute('DELETE FROM open_positions')
+        _begin_immediate(cursor)
 
-        # Insert new positions
-        for pos in positions:
-            cursor.execute('''
-                INSERT INTO open_positions
-                (account_id, symbol, side, quantity, entry_price, mark_price,
-                 unrealized_pnl, leverage, stop_price, stop_order_id, stop_type, tp_price, tp_order_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                pos['account_id'],
-                pos['symbol'],
-                pos['side'],
-                pos['quantity'],
-                pos['entry_price'],
-                pos['mark_price'],
-                pos['unrealized_pnl'],
-                pos['leverage'],
-                pos.get('stop_price'),
-                pos.get('stop_order_id'),
-                pos.get('stop_type'),
-                pos.get('tp_price'),
-                pos.get('tp_order_id')
-            ))
+        # Drop positions that have closed since the last save
+        cursor.execute(_SQL_DELETE_STALE_OPEN_POSITIONS, (keys,))
+
+        # Insert new positions and update the ones still open
+        cursor.executemany(_SQL_INSERT_OPEN_POSITION, rows)
+
+        if timestamp is not None:
+            cursor.execute(_SQL_SET_POSITIONS_CACHE_TIME, (str(timestamp),))
 
         conn.commit()
-        conn.close()
 
 
 def get_open_positions():
     """Get all open positions from database with account info."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
-            SELECT p.*, a.name as account_name, a.is_testnet
+            SELECT
+                p.account_id, a.name as account_name, a.is_testnet, p.symbol, p.side,
+                p.quantity, p.entry_price, p.mark_price, p.unrealized_pnl, p.leverage,
+                p.stop_price, p.stop_order_id, p.stop_type, p.tp_price, p.tp_order_id
             FROM open_positions p
             JOIN accounts a ON p.account_id = a.id
             ORDER BY a.name, p.symbol
         ''')
-        rows = cursor.fetchall()
-        conn.close()
 
-        positions = []
-        for row in rows:
-            positions.append({
-                'account_id': row['account_id'],
-                'account_name': row['account_name'],
-                'is_testnet': bool(row['is_testnet']),
-                'symbol': row['symbol'],
-                'side': row['side'],
-                'quantity': row['quantity'],
-                'entry_price': row['entry_price'],
-                'mark_price': row['mark_price'],
-                'unrealized_pnl': row['unrealized_pnl'],
-                'leverage': row['leverage'],
-                'stop_price': row['stop_price'],
-                'stop_order_id': row['stop_order_id'],
-                'stop_type': row['stop_type'],
-                'tp_price': row['tp_price'],
-                'tp_order_id': row['tp_order_id']
-            })
+        positions = [dict(row) for row in cursor.fetchall()]
+        for position in positions:
+            position['is_testnet'] = bool(position['is_testnet'])
         return positions
 
 
 def clear_open_positions():
     """Clear all cached open positions."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
+
+        _begin_immediate(cursor)
+        # No WHERE clause, triggers or child tables, so SQLite uses its
+        # truncate optimization instead of deleting row by row
         cursor.execute('DELETE FROM open_positions')
         cursor.execute('DELETE FROM cache_meta WHERE key = ?', ('positions_updated',))
         conn.commit()
-        conn.close()
 
 
 # ==================== CLOSED POSITIONS OPERATIONS ====================
 
+# In-memory closed position stats: account_id -> (stats, expires_at). Writers in this
+# module invalidate it; the TTL bounds staleness if another process writes
+CLOSED_STATS_CACHE_TTL = 30  # seconds
+_closed_stats_cache = {}
+_closed_stats_cache_lock = Lock()
+_closed_stats_generation = 0
+
+
+def _invalidate_closed_positions_stats(account_id=None):
+    """Drop cached closed position stats for one account, or for all accounts."""
+    global _closed_stats_generation
+    with _closed_stats_cache_lock:
+        _closed_stats_generation += 1
+        if account_id is None:
+            _closed_stats_cache.clear()
+        else:
+            _closed_stats_cache.pop(account_id, None)
+
+
+# duration_seconds is derived from the ISO entry/exit times in SQL (NULL if either is missing
+# or unparseable); rounding to the millisecond first absorbs julianday's float error before
+# the truncating cast
+_SQL_INSERT_CLOSED_POSITION = '''
+    INSERT INTO closed_positions (
+        account_id, symbol, side, quantity, entry_price, exit_price, size_usd,
+        realized_pnl, commission, entry_time, exit_time, duration_seconds, trade_ids
+    ) VALUES (
+        ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?11,
+        CAST(ROUND((julianday(?11) - julianday(?10)) * 86400, 3) AS INTEGER), ?12
+    )
+'''
+
+
 def insert_closed_position(account_id, symbol, side, quantity, entry_price, exit_price,
                            realized_pnl, commission, entry_time, exit_time, trade_ids=None):
     """Insert a closed position record."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         # Calculate position size in USD
         size_usd = quantity * entry_price
 
-        # Calculate duration in seconds
-        duration_seconds = None
-        if entry_time and exit_time:
-            try:
-                from datetime import datetime
-                entry_dt = datetime.fromisoformat(entry_time.replace('Z', '+00:00')) if isinstance(entry_time, str) else entry_time
-                exit_dt = datetime.fromisoformat(exit_time.replace('Z', '+00:00')) if isinstance(exit_time, str) else exit_time
-                duration_seconds = int((exit_dt - entry_dt).total_seconds())
-            except:
-                pass
-
         # Convert trade_ids list to comma-separated string
         trade_ids_str = ','.join(map(str, trade_ids)) if trade_ids else None
 
-        cursor.execute('''
-            INSERT INTO closed_positions (
-                account_id, symbol, side, quantity, entry_price, exit_price, size_usd,
-                realized_pnl, commission, entry_time, exit_time, duration_seconds, trade_ids
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (account_id, symbol, side, quantity, entry_price, exit_price, size_usd,
-              realized_pnl, commission, entry_time, exit_time, duration_seconds, trade_ids_str))
+        cursor.execute(_SQL_INSERT_CLOSED_POSITION, (
+            account_id, symbol, side, quantity, entry_price, exit_price, size_usd,
+            realized_pnl, commission, entry_time, exit_time, trade_ids_str
+        ))
 
         position_id = cursor.lastrowid
         conn.commit()
-        conn.close()
+        _invalidate_closed_positions_stats(account_id)
         return position_id
 
 
-def get_closed_positions(account_id=None, symbol=None, limit=100, offset=0):
-    """Get closed positions with optional filters, including setup info."""
-    with db_lock:
-        conn = get_connection()
+_SQL_CLOSED_POSITIONS_SELECT = '''
+    SELECT
+        cp.id, cp.account_id, a.name as account_name, cp.symbol, cp.side,
+        cp.quantity, cp.entry_price, cp.exit_price,
+        ROUND(cp.size_usd, 2) as size_usd,
+        cp.realized_pnl, cp.commission, cp.entry_time, cp.exit_time,
+        cp.duration_seconds, cp.trade_ids, cp.setup_id, s.name as setup_name{total_column}
+    FROM closed_positions cp
+    JOIN accounts a ON cp.account_id = a.id
+    LEFT JOIN setups s ON cp.setup_id = s.id
+'''
+# Full page queries keyed by (filter by account, filter by symbol, with total). All take
+# (account_id, symbol, limit, offset) as ?1..?4; a variant simply leaves unused slots unreferenced
+_SQL_GET_CLOSED_POSITIONS = {
+    (by_account, by_symbol, with_total): (
+        _SQL_CLOSED_POSITIONS_SELECT.format(
+            total_column=', COUNT(*) OVER () as total_count' if with_total else ''
+        )
+        + {
+            (False, False): '',
+            (True, False): '    WHERE cp.account_id = ?1\n',
+            (False, True): '    WHERE cp.symbol = ?2\n',
+            (True, True): '    WHERE cp.account_id = ?1 AND cp.symbol = ?2\n',
+        }[by_account, by_symbol]
+        + '    ORDER BY cp.exit_time DESC LIMIT ?3 OFFSET ?4\n'
+    )
+    for by_account in (False, True)
+    for by_symbol in (False, True)
+    for with_total in (False, True)
+}
+
+
+def get_closed_positions(account_id=None, symbol=None, limit=100, offset=0, with_total=False):
+    """
+    Get closed positions with optional filters, including setup info.
+    With with_total=True returns (positions, total matching count), the count coming
+    from the same query via a window function.
+    """
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        query = '''
-            SELECT cp.*, a.name as account_name, s.name as setup_name
-            FROM closed_positions cp
-            JOIN accounts a ON cp.account_id = a.id
-            LEFT JOIN setups s ON cp.setup_id = s.id
-            WHERE 1=1
-        '''
-        params = []
-
-        if account_id:
-            query += ' AND cp.account_id = ?'
-            params.append(account_id)
-
-        if symbol:
-            query += ' AND cp.symbol = ?'
-            params.append(symbol)
+        query = _SQL_GET_CLOSED_POSITIONS[bool(account_id), bool(symbol), with_total]
+        cursor.execute(query, (account_id, symbol, limit, offset))
 
-        query += ' ORDER BY cp.exit_time DESC LIMIT ? OFFSET ?'
-        params.extend([limit, offset])
+        positions = [dict(row) for row in cursor.fetchall()]
+        if not with_total:
+            return positions
 
-        cursor.execute(query, params)
-
-        positions = []
-        for row in cursor.fetchall():
-            # Calculate size_usd if not in DB (for backwards compatibility)
-            size_usd = row['size_usd'] if 'size_usd' in row.keys() and row['size_usd'] else row['quantity'] * row['entry_price']
-            positions.append({
-                'id': row['id'],
-                'account_id': row['account_id'],
-                'account_name': row['account_name'],
-                'symbol': row['symbol'],
-                'side': row['side'],
-                'quantity': row['quantity'],
-                'entry_price': row['entry_price'],
-                'exit_price': row['exit_price'],
-                'size_usd': round(size_usd, 2),
-                'realized_pnl': row['realized_pnl'],
-                'commission': row['commission'],
-                'entry_time': row['entry_time'],
-                'exit_time': row['exit_time'],
-                'duration_seconds': row['duration_seconds'],
-                'trade_ids': row['trade_ids'],
-                'setup_id': row['setup_id'] if 'setup_id' in row.keys() else None,
-                'setup_name': row['setup_name'] if 'setup_name' in row.keys() else None
-            })
-
-        conn.close()
-        return positions
+        if positions:
+            total = positions[0]['total_count']
+            for position in positions:
+                del position['total_count']
+        elif offset:
+            # Page past the end: no row carries the count, so ask for it directly
+            total = get_closed_positions_count(account_id=account_id, symbol=symbol)
+        else:
+            total = 0
+        return positions, total
 
 
 def get_closed_positions_count(account_id=None, symbol=None):
     """Get total count of closed positions for pagination."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         query = 'SELECT COUNT(*) as count FROM closed_positions WHERE 1=1'
@@ -1342,200 +1954,213 @@ def get_closed_positions_count(account_id=None, symbol=None):
 
         cursor.execute(query, params)
         row = cursor.fetchone()
-        conn.close()
 
         return row['count'] if row else 0
 
 
 def delete_closed_position(position_id):
     """Delete a closed position."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM closed_positions WHERE id = ?', (position_id,))
         deleted = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
+        _invalidate_closed_positions_stats()
         return deleted
 
 
+
+
+def _match_closed_cycles(account_id, symbol, trades):
+    """
+    Replay one symbol's time-ordered trades and return its closed position cycles.
+    Each trade is a (symbol, quantity, price, side, realized_pnl, commission, trade_time,
+    exchange_trade_id) row; each result is a _SQL_INSERT_CLOSED_POSITION parameter tuple.
+    """
+    closed = []
+    position_qty = 0
+    position_side = None
+    entry_time = None
+    entry_trade_ids = ''  # Comma-joined exchange ids of the entry trades, grown as entries are added
+    total_entry_cost = 0
+    total_entry_qty = 0  # Track entry quantity separately for accurate avg price calculation
+    total_commission = 0
+
+    for _, quantity, price, trade_side, realized_pnl, commission, trade_time, exchange_trade_id in trades:
+        trade_qty = float(quantity)
+        trade_price = float(price)
+        trade_pnl = float(realized_pnl or 0)
+        trade_commission = float(commission or 0)
+
+        # Determine if this is opening or closing a position
+        # BUY increases position (opens LONG or closes SHORT)
+        # SELL decreases position (opens SHORT or closes LONG)
+
+        if position_qty == 0:
+            # Starting a new position
+            position_side = 'LONG' if trade_side == 'BUY' else 'SHORT'
+            position_qty = trade_qty
+            entry_time = trade_time
+            entry_trade_ids = str(exchange_trade_id)
+            total_entry_cost = trade_qty * trade_price
+            total_entry_qty = trade_qty
+            total_commission = trade_commission
+        elif (position_side == 'LONG' and trade_side == 'BUY') or \
+             (position_side == 'SHORT' and trade_side == 'SELL'):
+            # Adding to position
+            position_qty += trade_qty
+            entry_trade_ids += ',' + str(exchange_trade_id)
+            total_entry_cost += trade_qty * trade_price
+            total_entry_qty += trade_qty
+            total_commission += trade_commission
+        else:
+            # Closing position (partially or fully)
+            close_qty = min(trade_qty, position_qty)
+            total_commission += trade_commission
+
+            if close_qty > 0:
+                # Calculate weighted average entry price using tracked quantities
+                avg_entry_price = total_entry_cost / total_entry_qty if total_entry_qty > 0 else 0
+
+                # Calculate P&L for this close
+                # Use the realized_pnl from Binance if available (it's more accurate)
+                pnl = trade_pnl
+
+                # If no realized_pnl from trade, calculate it
+                if pnl == 0 and avg_entry_price > 0:
+                    if position_side == 'LONG':
+                        pnl = (trade_price - avg_entry_price) * close_qty
+                    else:
+                        pnl = (avg_entry_price - trade_price) * close_qty
+
+                # Get exit time
+                exit_time = trade_time
+
+                # Get trade IDs
+                exit_trade_id = str(exchange_trade_id)
+                trade_ids_str = entry_trade_ids + ',' + exit_trade_id if entry_trade_ids else exit_trade_id
+
+                # Calculate position size in USD
+                size_usd = close_qty * avg_entry_price
+
+                # Record the closed cycle as a _SQL_INSERT_CLOSED_POSITION row
+                closed.append((
+                    account_id, symbol, position_side, close_qty, avg_entry_price, trade_price, size_usd,
+                    pnl, total_commission, entry_time, exit_time, trade_ids_str
+                ))
+
+            # Update remaining position
+            position_qty -= close_qty
+            remaining_to_close = trade_qty - close_qty
+
+            if position_qty <= 0.00001:  # Position fully closed (use small epsilon for float comparison)
+                position_qty = 0
+
+                # If there's remaining quantity from this trade, it opens a new position
+                if remaining_to_close > 0.00001:
+                    position_side = 'LONG' if trade_side == 'BUY' else 'SHORT'
+                    position_qty = remaining_to_close
+                    entry_time = trade_time
+                    entry_trade_ids = str(exchange_trade_id)
+                    total_entry_cost = remaining_to_close * trade_price
+                    total_entry_qty = remaining_to_close
+                    total_commission = 0
+                else:
+                    position_side = None
+                    entry_time = None
+                    entry_trade_ids = ''
+                    total_entry_cost = 0
+                    total_entry_qty = 0
+                    total_commission = 0
+            else:
+                # Position partially closed, adjust entry data proportionally
+                close_ratio = close_qty / (position_qty + close_qty)
+                total_entry_cost *= (1 - close_ratio)
+                total_entry_qty *= (1 - close_ratio)
+
+    return closed
+
+
 def process_trades_into_closed_positions(account_id):
     """
     Process all trades for an account and generate closed position records.
     This groups trades by symbol and calculates complete position cycles.
     """
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
+        cursor.row_factory = None  # plain tuples, unpacked below
+
+        _begin_immediate(cursor)
 
-        # Get all trades for the account, ordered by time
+        # Clear existing closed positions for this account
+        cursor.execute('DELETE FROM closed_positions WHERE account_id = ?', (account_id,))
+
+        # Stream all trades for the account, ordered by symbol then time
         cursor.execute('''
-            SELECT * FROM trades
+            SELECT symbol, quantity, price, side, realized_pnl, commission, trade_time, exchange_trade_id
+            FROM trades
             WHERE account_id = ?
             ORDER BY symbol, trade_time ASC
         ''', (account_id,))
 
-        trades = cursor.fetchall()
-
-        # Clear existing closed positions for this account
-        cursor.execute('DELETE FROM closed_positions WHERE account_id = ?', (account_id,))
+        # Process each symbol's trades to find closed positions; rows arrive grouped by
+        # symbol, so groupby walks the cursor once without materializing the trades
+        pending_inserts = []
+        for symbol, symbol_trades in groupby(cursor, key=itemgetter(0)):
+            pending_inserts += _match_closed_cycles(account_id, symbol, symbol_trades)
 
-        # Group trades by symbol
-        trades_by_symbol = {}
-        for trade in trades:
-            symbol = trade['symbol']
-            if symbol not in trades_by_symbol:
-                trades_by_symbol[symbol] = []
-            trades_by_symbol[symbol].append(dict(trade))
-
-        # Process each symbol's trades to find closed positions
-        for symbol, symbol_trades in trades_by_symbol.items():
-            position_qty = 0
-            position_side = None
-            entry_trades = []
-            total_entry_cost = 0
-            total_entry_qty = 0  # Track entry quantity separately for accurate avg price calculation
-            total_commission = 0
-
-            for trade in symbol_trades:
-                trade_qty = float(trade['quantity'])
-                trade_price = float(trade['price'])
-                trade_side = trade['side']
-                trade_pnl = float(trade['realized_pnl'] or 0)
-                trade_commission = float(trade['commission'] or 0)
-
-                # Determine if this is opening or closing a position
-                # BUY increases position (opens LONG or closes SHORT)
-                # SELL decreases position (opens SHORT or closes LONG)
-
-                if position_qty == 0:
-                    # Starting a new position
-                    position_side = 'LONG' if trade_side == 'BUY' else 'SHORT'
-                    position_qty = trade_qty
-                    entry_trades = [trade]
-                    total_entry_cost = trade_qty * trade_price
-                    total_entry_qty = trade_qty
-                    total_commission = trade_commission
-                elif (position_side == 'LONG' and trade_side == 'BUY') or \
-                     (position_side == 'SHORT' and trade_side == 'SELL'):
-                    # Adding to position
-                    position_qty += trade_qty
-                    entry_trades.append(trade)
-                    total_entry_cost += trade_qty * trade_price
-                    total_entry_qty += trade_qty
-                    total_commission += trade_commission
-                else:
-                    # Closing position (partially or fully)
-                    close_qty = min(trade_qty, position_qty)
-                    total_commission += trade_commission
-
-                    if close_qty > 0:
-                        # Calculate weighted average entry price using tracked quantities
-                        avg_entry_price = total_entry_cost / total_entry_qty if total_entry_qty > 0 else 0
-
-                        # Calculate P&L for this close
-                        # Use the realized_pnl from Binance if available (it's more accurate)
-                        pnl = trade_pnl
-
-                        # If no realized_pnl from trade, calculate it
-                        if pnl == 0 and avg_entry_price > 0:
-                            if position_side == 'LONG':
-                                pnl = (trade_price - avg_entry_price) * close_qty
-                            else:
-                                pnl = (avg_entry_price - trade_price) * close_qty
-
-                        # Get entry and exit times
-                        entry_time = entry_trades[0]['trade_time'] if entry_trades else None
-                        exit_time = trade['trade_time']
-
-                        # Calculate duration
-                        duration_seconds = None
-                        if entry_time and exit_time:
-                            try:
-                                entry_dt = datetime.fromisoformat(entry_time.replace('Z', '+00:00')) if isinstance(entry_time, str) else entry_time
-                                exit_dt = datetime.fromisoformat(exit_time.replace('Z', '+00:00')) if isinstance(exit_time, str) else exit_time
-                                if hasattr(entry_dt, 'timestamp') and hasattr(exit_dt, 'timestamp'):
-                                    duration_seconds = int(exit_dt.timestamp() - entry_dt.timestamp())
-                            except:
-                                pass
-
-                        # Get trade IDs
-                        trade_ids = [str(t['exchange_trade_id']) for t in entry_trades]
-                        trade_ids.append(str(trade['exchange_trade_id']))
-                        trade_ids_str = ','.join(trade_ids)
-
-                        # Calculate position size in USD
-                        size_usd = close_qty * avg_entry_price
-
-                        # Insert closed position
-                        cursor.execute('''
-                            INSERT INTO closed_positions (
-                                account_id, symbol, side, quantity, entry_price, exit_price, size_usd,
-                                realized_pnl, commission, entry_time, exit_time, duration_seconds, trade_ids
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (account_id, symbol, position_side, close_qty, avg_entry_price, trade_price, size_usd,
-                              pnl, total_commission, entry_time, exit_time, duration_seconds, trade_ids_str))
-
-                    # Update remaining position
-                    position_qty -= close_qty
-                    remaining_to_close = trade_qty - close_qty
-
-                    if position_qty <= 0.00001:  # Position fully closed (use small epsilon for float comparison)
-                        position_qty = 0
-
-                        # If there's remaining quantity from this trade, it opens a new position
-                        if remaining_to_close > 0.00001:
-                            position_side = 'LONG' if trade_side == 'BUY' else 'SHORT'
-                            position_qty = remaining_to_close
-                            entry_trades = [trade]
-                            total_entry_cost = remaining_to_close * trade_price
-                            total_entry_qty = remaining_to_close
-                            total_commission = 0
-                        else:
-                            position_side = None
-                            entry_trades = []
-                            total_entry_cost = 0
-                            total_entry_qty = 0
-                            total_commission = 0
-                    else:
-                        # Position partially closed, adjust entry data proportionally
-                        close_ratio = close_qty / (position_qty + close_qty)
-                        total_entry_cost *= (1 - close_ratio)
-                        total_entry_qty *= (1 - close_ratio)
+        cursor.executemany(_SQL_INSERT_CLOSED_POSITION, pending_inserts)
 
         conn.commit()
-        conn.close()
+        _invalidate_closed_positions_stats(account_id)
         return True
 
 
 def get_closed_positions_stats(account_id):
-    """Get statistics for closed positions."""
-    with db_lock:
-        conn = get_connection()
+    """Get statistics for closed positions (cached per account until the next write or TTL)."""
+    now = time.monotonic()
+    with _closed_stats_cache_lock:
+        cached = _closed_stats_cache.get(account_id)
+        generation = _closed_stats_generation
+    if cached is not None and cached[1] > now:
+        return dict(cached[0]) if cached[0] is not None else None
+
+    stats = _query_closed_positions_stats(account_id)
+    with _closed_stats_cache_lock:
+        # Skip storing if a write invalidated the cache while we were querying
+        if generation == _closed_stats_generation:
+            _closed_stats_cache[account_id] = (stats, now + CLOSED_STATS_CACHE_TTL)
+    return dict(stats) if stats is not None else None
+
+
+def _query_closed_positions_stats(account_id):
+    """Read closed position statistics for an account from its trigger-maintained summary row."""
+    with get_connection() as conn:
         cursor = conn.cursor()
 
+        # One summary row per account; the LEFT JOIN yields NULLs (reported as zeros) for
+        # an account without closed positions
         cursor.execute('''
             SELECT
-                COUNT(*) as total_positions,
-                COALESCE(SUM(realized_pnl), 0) as total_pnl,
-                COALESCE(SUM(commission), 0) as total_commission,
-                COALESCE(SUM(quantity * entry_price), 0) as total_volume,
-                SUM(CASE WHEN realized_pnl > 0 THEN 1 ELSE 0 END) as winning_positions,
-                SUM(CASE WHEN realized_pnl < 0 THEN 1 ELSE 0 END) as losing_positions,
-                SUM(CASE WHEN realized_pnl = 0 THEN 1 ELSE 0 END) as breakeven_positions,
-                COALESCE(AVG(CASE WHEN realized_pnl > 0 THEN realized_pnl END), 0) as avg_win,
-                COALESCE(AVG(CASE WHEN realized_pnl < 0 THEN realized_pnl END), 0) as avg_loss,
-                COALESCE(MAX(realized_pnl), 0) as largest_win,
-                COALESCE(MIN(realized_pnl), 0) as largest_loss,
-                COALESCE(AVG(duration_seconds), 0) as avg_duration
-            FROM closed_positions
-            WHERE account_id = ?
+                s.total_positions,
+                s.sum_pnl as total_pnl,
+                s.sum_commission as total_commission,
+                s.sum_volume as total_volume,
+                s.winning as winning_positions,
+                s.losing as losing_positions,
+                s.breakeven as breakeven_positions,
+                s.sum_win / NULLIF(s.winning, 0) as avg_win,
+                s.sum_loss / NULLIF(s.losing, 0) as avg_loss,
+                s.max_pnl as largest_win,
+                s.min_pnl as largest_loss,
+                CAST(s.sum_duration AS REAL) / NULLIF(s.duration_count, 0) as avg_duration
+            FROM (SELECT 1)
+            LEFT JOIN closed_positions_summary s ON s.account_id = ?
         ''', (account_id,))
 
         row = cursor.fetchone()
-        conn.close()
 
         if row:
             total = row['total_positions'] or 0
@@ -1565,8 +2190,7 @@ def get_closed_positions_stats(account_id):
 
 def create_setup_folder(name, description=None, color='#fbbf24'):
     """Create a new setup folder. Returns folder id."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute(
@@ -1576,14 +2200,12 @@ def create_setup_folder(name, description=None, color='#fbbf24'):
         folder_id = cursor.lastrowid
 
         conn.commit()
-        conn.close()
         return folder_id
 
 
 def get_all_setup_folders():
     """Get all setup folders with setup count."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -1606,21 +2228,17 @@ def get_all_setup_folders():
                 'updated_at': row['updated_at']
             })
 
-        conn.close()
         return folders
 
 
 def get_setup_folder(folder_id):
     """Get a single setup folder by ID."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('SELECT * FROM setup_folders WHERE id = ?', (folder_id,))
         row = cursor.fetchone()
 
-        conn.close()
-
         if row:
             return {
                 'id': row['id'],
@@ -1635,8 +2253,7 @@ def get_setup_folder(folder_id):
 
 def update_setup_folder(folder_id, name=None, description=None, color=None):
     """Update a setup folder."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         updates = ['updated_at = CURRENT_TIMESTAMP']
@@ -1653,24 +2270,21 @@ def update_setup_folder(folder_id, name=None, description=None, color=None):
             params.append(color)
 
         params.append(folder_id)
-        cursor.execute(f'UPDATE setup_folders SET {", ".join(updates)} WHERE id = ?', params)
+        cursor.execute(_update_sql('setup_folders', tuple(updates)), params)
 
         conn.commit()
-        conn.close()
         return True
 
 
 def delete_setup_folder(folder_id):
     """Delete a setup folder. Setups in the folder will have folder_id set to NULL."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM setup_folders WHERE id = ?', (folder_id,))
         deleted = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return deleted
 
 
@@ -1678,8 +2292,7 @@ def delete_setup_folder(folder_id):
 
 def create_setup(name, folder_id=None, description=None, timeframe=None, image_data=None, notes=None):
     """Create a new setup. Returns setup id."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute(
@@ -1690,19 +2303,18 @@ def create_setup(name, folder_id=None, description=None, timeframe=None, image_d
         setup_id = cursor.lastrowid
 
         conn.commit()
-        conn.close()
         return setup_id
 
 
 def get_all_setups(folder_id=None):
     """Get all setups, optionally filtered by folder."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         if folder_id is not None:
             cursor.execute('''
-                SELECT s.*, sf.name as folder_name, sf.color as folder_color
+                SELECT s.id, s.folder_id, s.name, s.description, s.timeframe, s.image_data, s.notes,
+                       s.created_at, s.updated_at, sf.name as folder_name, sf.color as folder_color
                 FROM setups s
                 LEFT JOIN setup_folders sf ON s.folder_id = sf.id
                 WHERE s.folder_id = ?
@@ -1710,7 +2322,8 @@ def get_all_setups(folder_id=None):
             ''', (folder_id,))
         else:
             cursor.execute('''
-                SELECT s.*, sf.name as folder_name, sf.color as folder_color
+                SELECT s.id, s.folder_id, s.name, s.description, s.timeframe, s.image_data, s.notes,
+                       s.created_at, s.updated_at, sf.name as folder_name, sf.color as folder_color
                 FROM setups s
                 LEFT JOIN setup_folders sf ON s.folder_id = sf.id
                 ORDER BY s.created_at ASC
@@ -1732,204 +2345,179 @@ def get_all_setups(folder_id=None):
                 'updated_at': row['updated_at']
             })
 
-        conn.close()
         return setups
 
 
 def get_setup(setup_id):
     """Get a single setup by ID."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
-            SELECT s.*, sf.name as folder_name, sf.color as folder_color
+            SELECT s.id, s.folder_id, s.name, s.description, s.timeframe, s.image_data, s.notes,
+                   s.created_at, s.updated_at, sf.name as folder_name, sf.color as folder_color
             FROM setups s
             LEFT JOIN setup_folders sf ON s.folder_id = sf.id
             WHERE s.id = ?
         ''', (setup_id,))
         row = cursor.fetchone()
 
-        conn.close()
-
-        if row:
-            return {
-                'id': row['id'],
-                'folder_id': row['folder_id'],
-                'folder_name': row['folder_name'],
-                'folder_color': row['folder_color'],
-                'name': row['name'],
-                'description': row['description'],
-                'timeframe': row['timeframe'],
-                'image_data': row['image_data'],
-                'notes': row['notes'],
-                'created_at': row['created_at'],
-                'updated_at': row['updated_at']
-            }
-        return None
+        return dict(row) if row else None
 
 
 def update_setup(setup_id, name=None, folder_id=None, description=None, timeframe=None, image_data=None, notes=None):
     """Update a setup."""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        updates = ['updated_at = CURRENT_TIMESTAMP']
-        params = []
+    mask = 0
+    params = []
+
+    if name is not None:
+        mask |= 1
+        params.append(name)
+    if folder_id is not None:
+        mask |= 2
+        params.append(folder_id if folder_id != 0 else None)
+    if description is not None:
+        mask |= 4
+        params.append(description)
+    if timeframe is not None:
+        mask |= 8
+        params.append(timeframe)
+    if image_data is not None:
+        mask |= 16
+        params.append(image_data)
+    if notes is not None:
+        mask |= 32
+        params.append(notes)
+
+    if not mask:
+        return True
 
-        if name is not None:
-            updates.append('name = ?')
-            params.append(name)
-        if folder_id is not None:
-            updates.append('folder_id = ?')
-            params.append(folder_id if folder_id != 0 else None)
-        if description is not None:
-            updates.append('description = ?')
-            params.append(description)
-        if timeframe is not None:
-            updates.append('timeframe = ?')
-            params.append(timeframe)
-        if image_data is not None:
-            updates.append('image_data = ?')
-            params.append(image_data)
-        if notes is not None:
-            updates.append('notes = ?')
-            params.append(notes)
+    with get_connection(write=True) as conn:
+        cursor = conn.cursor()
 
         params.append(setup_id)
-        cursor.execute(f'UPDATE setups SET {", ".join(updates)} WHERE id = ?', params)
+        cursor.execute(_UPDATE_SETUP_SQL[mask], params)
 
         conn.commit()
-        conn.close()
         return True
 
 
 def delete_setup(setup_id):
     """Delete a setup."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM setups WHERE id = ?', (setup_id,))
         deleted = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return deleted
 
 
 # ==================== SETUP IMAGES OPERATIONS ====================
 
+SETUP_IMAGE_URL_PREFIX = '/static/uploads/setups/'
+
+
+# Adds the static path prefix to stored image filenames for frontend display
+_SETUP_IMAGE_URL_SQL = f'''CASE
+                WHEN image_path IS NULL OR image_path = ''
+                     OR substr(image_path, 1, 1) = '/' OR substr(image_path, 1, 5) = 'data:'
+                THEN image_path
+                ELSE '{SETUP_IMAGE_URL_PREFIX}' || image_path
+            END AS image_path'''
+_SQL_GET_SETUP_IMAGES = f'''
+    SELECT id, setup_id, timeframe, {_SETUP_IMAGE_URL_SQL}, notes, display_order, created_at
+    FROM setup_images
+    WHERE setup_id = ?
+    ORDER BY display_order, created_at
+'''
+
+
 def create_setup_image(setup_id, timeframe, image_path, notes=None, display_order=0):
     """Create a new setup image. Returns image id."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
-        cursor.execute(
+        image_id = cursor.execute(
             '''INSERT INTO setup_images (setup_id, timeframe, image_path, notes, display_order)
-               VALUES (?, ?, ?, ?, ?)''',
+               VALUES (?, ?, ?, ?, ?) RETURNING id''',
             (setup_id, timeframe, image_path, notes, display_order)
-        )
-        image_id = cursor.lastrowid
+        ).fetchone()[0]
 
         conn.commit()
-        conn.close()
         return image_id
 
 
 def get_setup_images(setup_id):
     """Get all images for a setup, ordered by display_order."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.row_factory = None  # plain tuples, unpacked positionally below
 
-        cursor.execute('''
-            SELECT id, setup_id, timeframe, image_path, notes, display_order, created_at
-            FROM setup_images
-            WHERE setup_id = ?
-            ORDER BY display_order, created_at
-        ''', (setup_id,))
-
-        images = []
-        for row in cursor.fetchall():
-            # Add static path prefix for frontend display
-            image_path = row['image_path']
-            if image_path and not image_path.startswith('/') and not image_path.startswith('data:'):
-                image_path = f'/static/uploads/setups/{image_path}'
-            images.append({
-                'id': row['id'],
-                'setup_id': row['setup_id'],
-                'timeframe': row['timeframe'],
-                'image_path': image_path,
-                'notes': row['notes'],
-                'display_order': row['display_order'],
-                'created_at': row['created_at']
-            })
+        cursor.execute(_SQL_GET_SETUP_IMAGES, (setup_id,))
+        rows = cursor.fetchall()
 
-        conn.close()
-        return images
+        return [{
+            'id': image_id,
+            'setup_id': image_setup_id,
+            'timeframe': timeframe,
+            'image_path': image_path,
+            'notes': notes,
+            'display_order': display_order,
+            'created_at': created_at
+        } for image_id, image_setup_id, timeframe, image_path, notes, display_order, created_at in rows]
 
 
 def get_setup_image(image_id):
     """Get a single setup image by ID."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
-        cursor.execute('SELECT * FROM setup_images WHERE id = ?', (image_id,))
+        cursor.execute('''
+            SELECT id, setup_id, timeframe, image_path, notes, display_order, created_at
+            FROM setup_images WHERE id = ?
+        ''', (image_id,))
         row = cursor.fetchone()
 
-        conn.close()
-
-        if row:
-            return {
-                'id': row['id'],
-                'setup_id': row['setup_id'],
-                'timeframe': row['timeframe'],
-                'image_path': row['image_path'],
-                'notes': row['notes'],
-                'display_order': row['display_order'],
-                'created_at': row['created_at']
-            }
-        return None
+        return dict(row) if row else None
 
 
 def update_setup_image(image_id, timeframe=None, notes=None, display_order=None):
     """Update a setup image."""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        updates = []
-        params = []
+    mask = 0
+    params = []
+
+    if timeframe is not None:
+        mask |= 1
+        params.append(timeframe)
+    if notes is not None:
+        mask |= 2
+        params.append(notes)
+    if display_order is not None:
+        mask |= 4
+        params.append(display_order)
+
+    if not mask:
+        return True
 
-        if timeframe is not None:
-            updates.append('timeframe = ?')
-            params.append(timeframe)
-        if notes is not None:
-            updates.append('notes = ?')
-            params.append(notes)
-        if display_order is not None:
-            updates.append('display_order = ?')
-            params.append(display_order)
+    with get_connection(write=True) as conn:
+        cursor = conn.cursor()
 
-        if updates:
-            params.append(image_id)
-            cursor.execute(f'UPDATE setup_images SET {", ".join(updates)} WHERE id = ?', params)
+        params.append(image_id)
+        cursor.execute(_UPDATE_SETUP_IMAGE_SQL[mask], params)
 
         conn.commit()
-        conn.close()
         return True
 
 
 def delete_setup_image(image_id):
     """Delete a setup image. Returns the image_path for file cleanup."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        _begin_immediate(cursor)
+
         # Get the image path before deleting
         cursor.execute('SELECT image_path FROM setup_images WHERE id = ?', (image_id,))
         row = cursor.fetchone()
@@ -1939,7 +2527,6 @@ def delete_setup_image(image_id):
         deleted = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return image_path if deleted else None
 
 
@@ -1947,8 +2534,7 @@ def delete_setup_image(image_id):
 
 def link_position_to_setup(position_id, setup_id):
     """Link a closed position to a setup."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute(
@@ -1958,14 +2544,12 @@ def link_position_to_setup(position_id, setup_id):
         updated = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return updated
 
 
 def unlink_position_from_setup(position_id):
     """Unlink a closed position from its setup."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute(
@@ -1975,63 +2559,91 @@ def unlink_position_from_setup(position_id):
         updated = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return updated
 
 
-def get_setup_performance(setup_id):
-    """Calculate performance stats for a setup from linked trades."""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT
-                COUNT(*) as total_trades,
-                SUM(CASE WHEN realized_pnl > 0 THEN 1 ELSE 0 END) as winning_trades,
-                SUM(CASE WHEN realized_pnl < 0 THEN 1 ELSE 0 END) as losing_trades,
-                COALESCE(SUM(realized_pnl), 0) as total_pnl,
-                COALESCE(AVG(realized_pnl), 0) as avg_pnl
-            FROM closed_positions
-            WHERE setup_id = ?
-        ''', (setup_id,))
+def _query_setup_performance(conn, setup_ids):
+    """Run the grouped performance aggregate for the given setups. Returns {setup_id: totals}."""
+    cursor = conn.cursor()
+    cursor.row_factory = None  # plain tuples, unpacked positionally below
+
+    placeholders = ','.join('?' * len(setup_ids))
+    cursor.execute(f'''
+        SELECT
+            setup_id,
+            COUNT(*) as total_trades,
+            SUM(realized_pnl > 0) as winning_trades,
+            SUM(realized_pnl < 0) as losing_trades,
+            COALESCE(SUM(realized_pnl), 0) as total_pnl,
+            COALESCE(AVG(realized_pnl), 0) as avg_pnl
+        FROM closed_positions
+        WHERE setup_id IN ({placeholders})
+        GROUP BY setup_id
+    ''', setup_ids)
+
+    perf_by_setup = {}
+    for setup_id, total_trades, winning_trades, losing_trades, total_pnl, avg_pnl in cursor.fetchall():
+        perf_by_setup[setup_id] = {
+            'total_trades': total_trades,
+            'winning_trades': winning_trades,
+            'losing_trades': losing_trades,
+            'total_pnl': total_pnl,
+            'avg_pnl': avg_pnl
+        }
+    return perf_by_setup
 
-        row = cursor.fetchone()
-        conn.close()
 
-        if row and row['total_trades'] > 0:
-            total = row['total_trades']
-            winning = row['winning_trades'] or 0
-            losing = row['losing_trades'] or 0
-            win_rate = round(winning / total * 100, 1) if total > 0 else 0
+def _format_setup_performance(row):
+    """Build the performance stats dict from an aggregate row (None if no linked trades)."""
+    if row and row['total_trades'] > 0:
+        total = row['total_trades']
+        winning = row['winning_trades'] or 0
+        losing = row['losing_trades'] or 0
+        win_rate = round(winning / total * 100, 1) if total > 0 else 0
 
-            return {
-                'total_trades': total,
-                'winning_trades': winning,
-                'losing_trades': losing,
-                'win_rate': win_rate,
-                'total_pnl': round(row['total_pnl'], 2),
-                'avg_pnl': round(row['avg_pnl'], 2)
-            }
         return {
-            'total_trades': 0,
-            'winning_trades': 0,
-            'losing_trades': 0,
-            'win_rate': 0,
-            'total_pnl': 0,
-            'avg_pnl': 0
+            'total_trades': total,
+            'winning_trades': winning,
+            'losing_trades': losing,
+            'win_rate': win_rate,
+            'total_pnl': round(row['total_pnl'], 2),
+            'avg_pnl': round(row['avg_pnl'], 2)
         }
+    return {
+        'total_trades': 0,
+        'winning_trades': 0,
+        'losing_trades': 0,
+        'win_rate': 0,
+        'total_pnl': 0,
+        'avg_pnl': 0
+    }
+
+
+def get_performance_for_setups(setup_ids):
+    """Calculate performance stats for several setups in one query. Returns {setup_id: stats}."""
+    if not setup_ids:
+        return {}
+
+    with get_connection() as conn:
+        perf_by_setup = _query_setup_performance(conn, setup_ids)
+
+        return {setup_id: _format_setup_performance(perf_by_setup.get(setup_id)) for setup_id in setup_ids}
+
+
+def get_setup_performance(setup_id):
+    """Calculate performance stats for a setup from linked trades."""
+    return get_performance_for_setups([setup_id])[setup_id]
 
 
 def get_all_setups_with_stats(folder_id=None):
     """Get all setups with performance stats and images included."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         if folder_id is not None:
             cursor.execute('''
-                SELECT s.*, sf.name as folder_name, sf.color as folder_color
+                SELECT s.id, s.folder_id, s.name, s.description, s.timeframe, s.image_data, s.notes,
+                       s.created_at, s.updated_at, sf.name as folder_name, sf.color as folder_color
                 FROM setups s
                 LEFT JOIN setup_folders sf ON s.folder_id = sf.id
                 WHERE s.folder_id = ?
@@ -2039,75 +2651,60 @@ def get_all_setups_with_stats(folder_id=None):
             ''', (folder_id,))
         else:
             cursor.execute('''
-                SELECT s.*, sf.name as folder_name, sf.color as folder_color
+                SELECT s.id, s.folder_id, s.name, s.description, s.timeframe, s.image_data, s.notes,
+                       s.created_at, s.updated_at, sf.name as folder_name, sf.color as folder_color
                 FROM setups s
                 LEFT JOIN setup_folders sf ON s.folder_id = sf.id
                 ORDER BY s.created_at ASC
             ''')
 
-        setups = []
-        for row in cursor.fetchall():
-            setup_id = row['id']
-
-            # Get images for this setup
-            cursor.execute('''
-                SELECT id, timeframe, image_path, notes, display_order
+        rows = cursor.fetchall()
+        setup_ids = [row['id'] for row in rows]
+        placeholders = ','.join('?' * len(setup_ids))
+
+        image_rows = []
+        perf_by_setup = {}
+        if setup_ids:
+            # Get images for all setups in one query
+            image_cursor = conn.cursor()
+            image_cursor.row_factory = None  # plain tuples, unpacked positionally below
+            image_cursor.execute(f'''
+                SELECT setup_id, id, timeframe, {_SETUP_IMAGE_URL_SQL}, notes, display_order
                 FROM setup_images
-                WHERE setup_id = ?
-                ORDER BY display_order, created_at
-            ''', (setup_id,))
-            images = []
-            for img in cursor.fetchall():
-                img_dict = dict(img)
-                # Add static path prefix for frontend display
-                if img_dict['image_path'] and not img_dict['image_path'].startswith('/') and not img_dict['image_path'].startswith('data:'):
-                    img_dict['image_path'] = f'/static/uploads/setups/{img_dict["image_path"]}'
-                images.append(img_dict)
-
-            # Get performance stats
-            cursor.execute('''
-                SELECT
-                    COUNT(*) as total_trades,
-                    SUM(CASE WHEN realized_pnl > 0 THEN 1 ELSE 0 END) as winning_trades,
-                    COALESCE(SUM(realized_pnl), 0) as total_pnl
-                FROM closed_positions
-                WHERE setup_id = ?
-            ''', (setup_id,))
-            perf_row = cursor.fetchone()
-
-            total_trades = perf_row['total_trades'] or 0
-            winning = perf_row['winning_trades'] or 0
-            win_rate = round(winning / total_trades * 100, 1) if total_trades > 0 else 0
+                WHERE setup_id IN ({placeholders})
+                ORDER BY setup_id, display_order, created_at
+            ''', setup_ids)
+            image_rows = image_cursor.fetchall()
 
-            setups.append({
-                'id': setup_id,
-                'folder_id': row['folder_id'],
-                'folder_name': row['folder_name'],
-                'folder_color': row['folder_color'],
-                'name': row['name'],
-                'description': row['description'],
-                'timeframe': row['timeframe'],
-                'image_data': row['image_data'],  # Legacy support
-                'notes': row['notes'],
-                'images': images,
-                'performance': {
-                    'total_trades': total_trades,
-                    'winning_trades': winning,
-                    'win_rate': win_rate,
-                    'total_pnl': round(perf_row['total_pnl'] or 0, 2)
-                },
-                'created_at': row['created_at'],
-                'updated_at': row['updated_at']
-            })
+            # Get performance stats for all setups in one grouped query
+            perf_by_setup = _query_setup_performance(conn, setup_ids)
 
-        conn.close()
-        return setups
+    # Everything below is pure Python, so the connection is released before it runs
+
+    images_by_setup = defaultdict(list)
+    for setup_id, image_id, timeframe, image_path, notes, display_order in image_rows:
+        images_by_setup[setup_id].append({
+            'id': image_id,
+            'timeframe': timeframe,
+            'image_path': image_path,
+            'notes': notes,
+            'display_order': display_order
+        })
+
+    setups = []
+    for row in rows:
+        setup_id = row['id']
+        setup = dict(row)  # image_data kept for legacy support
+        setup['images'] = images_by_setup[setup_id]
+        setup['performance'] = _format_setup_performance(perf_by_setup.get(setup_id))
+        setups.append(setup)
+
+    return setups
 
 
 def get_setups_simple_list():
     """Get a simple list of setups for dropdown selection."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2125,31 +2722,46 @@ def get_setups_simple_list():
                 'folder_name': row['folder_name']
             })
 
-        conn.close()
         return setups
 
 
 # ==================== TRADE NOTIFICATIONS OPERATIONS ====================
 
+# In-memory settings cache: key -> (value or None if missing, expires_at)
+SETTINGS_CACHE_TTL = 30  # seconds, bounds staleness if another process writes
+_settings_cache = {}
+_settings_cache_lock = Lock()
+
+
 def get_setting(key, default=None):
     """Get a setting value."""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-        row = cursor.fetchone()
-        conn.close()
-        return row['value'] if row else default
+    now = time.monotonic()
+    with _settings_cache_lock:
+        cached = _settings_cache.get(key)
+    if cached is not None and cached[1] > now:
+        value = cached[0]
+    else:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
+            row = cursor.fetchone()
+        value = row['value'] if row else None
+        with _settings_cache_lock:
+            _settings_cache[key] = (value, now + SETTINGS_CACHE_TTL)
+    return value if value is not None else default
 
 
 def set_setting(key, value):
     """Set a setting value."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
-        cursor.execute('INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)', (key, str(value)))
+        cursor.execute('''
+            INSERT INTO settings (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (key, str(value)))
         conn.commit()
-        conn.close()
+        with _settings_cache_lock:
+            _settings_cache[key] = (str(value), time.monotonic() + SETTINGS_CACHE_TTL)
         return True
 
 
@@ -2165,55 +2777,96 @@ def set_trade_notifications_enabled(enabled):
 
 def add_trade_notification(account_id, symbol, side, event_type, entry_price=None, exit_price=None, pnl=None):
     """Add a trade notification to history."""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
+    return add_trade_notifications_bulk([
+        (account_id, symbol, side, event_type, entry_price, exit_price, pnl)
+    ])[0]
 
-        cursor.execute('''
+
+# Multi-row notification INSERTs keyed by row count, so each size is built once and its
+# text stays identical for the connection's statement cache
+_insert_notifications_sql_cache = {}
+
+
+def _insert_notifications_sql(count):
+    """Return the cached INSERT ... RETURNING id statement for count notification rows."""
+    sql = _insert_notifications_sql_cache.get(count)
+    if sql is None:
+        sql = f'''
             INSERT INTO trade_notifications (account_id, symbol, side, event_type, entry_price, exit_price, pnl)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (account_id, symbol.upper(), side, event_type, entry_price, exit_price, pnl))
+            VALUES {", ".join(["(?, ?, ?, ?, ?, ?, ?)"] * count)}
+            RETURNING id
+        '''
+        _insert_notifications_sql_cache[count] = sql
+    return sql
+
+
+def _insert_notifications(cursor, rows):
+    """Insert notification rows on the caller's transaction. Returns the new ids."""
+    notification_ids = []
+    # One multi-row INSERT per chunk keeps well under SQLite's bound-parameter limit
+    for start in range(0, len(rows), 500):
+        chunk = rows[start:start + 500]
+        params = []
+        for account_id, symbol, side, event_type, entry_price, exit_price, pnl in chunk:
+            params.extend((account_id, symbol.upper(), side, event_type, entry_price, exit_price, pnl))
+        cursor.execute(_insert_notifications_sql(len(chunk)), params)
+        # RETURNING order is unspecified; ids are assigned in insertion order
+        notification_ids.extend(sorted(row[0] for row in cursor.fetchall()))
+    return notification_ids
+
+
+def add_trade_notifications_bulk(rows):
+    """
+    Add multiple trade notifications in a single transaction.
+    Each row is (account_id, symbol, side, event_type, entry_price, exit_price, pnl).
+    Returns the list of new notification ids.
+    """
+    if not rows:
+        return []
+
+    with get_connection(write=True) as conn:
+        cursor = conn.cursor()
+
+        _begin_immediate(cursor)
+        notification_ids = _insert_notifications(cursor, rows)
 
-        notification_id = cursor.lastrowid
         conn.commit()
-        conn.close()
-        return notification_id
+        return notification_ids
 
 
 def get_trade_notifications(limit=50):
     """Get recent trade notifications."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
+        # Apply ORDER BY + LIMIT on the narrow index before joining accounts
         cursor.execute('''
             SELECT tn.*, a.name as account_name
-            FROM trade_notifications tn
+            FROM (
+                SELECT * FROM trade_notifications
+                ORDER BY created_at DESC
+                LIMIT ?
+            ) tn
             LEFT JOIN accounts a ON tn.account_id = a.id
             ORDER BY tn.created_at DESC
-            LIMIT ?
         ''', (limit,))
 
         notifications = [dict(row) for row in cursor.fetchall()]
-        conn.close()
         return notifications
 
 
 def clear_trade_notifications():
     """Clear all trade notifications."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute('DELETE FROM trade_notifications')
         conn.commit()
-        conn.close()
         return True
 
 
 def get_position_snapshots(account_id):
     """Get position snapshots for an account."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2223,44 +2876,97 @@ def get_position_snapshots(account_id):
         ''', (account_id,))
 
         snapshots = {row['symbol']: dict(row) for row in cursor.fetchall()}
-        conn.close()
         return snapshots
 
 
 def update_position_snapshot(account_id, symbol, side, entry_price, quantity):
     """Update or insert a position snapshot."""
-    with db_lock:
-        conn = get_connection()
+    return update_position_snapshots_bulk([(account_id, symbol, side, entry_price, quantity)])
+
+
+def _upsert_position_snapshots(cursor, rows):
+    """Update or insert snapshot rows on the caller's transaction."""
+    cursor.executemany('''
+        INSERT INTO position_snapshots (account_id, symbol, side, entry_price, quantity, updated_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(account_id, symbol) DO UPDATE SET
+            side = excluded.side,
+            entry_price = excluded.entry_price,
+            quantity = excluded.quantity,
+            updated_at = excluded.updated_at
+    ''', [(account_id, symbol.upper(), side, entry_price, quantity)
+          for account_id, symbol, side, entry_price, quantity in rows])
+
+
+def _delete_position_snapshots(cursor, account_id, symbols):
+    """Delete an account's snapshots for the given symbols on the caller's transaction."""
+    cursor.executemany('DELETE FROM position_snapshots WHERE account_id = ? AND symbol = ?',
+                       [(account_id, symbol.upper()) for symbol in symbols])
+
+
+def update_position_snapshots_bulk(rows):
+    """
+    Update or insert multiple position snapshots in a single transaction.
+    Each row is (account_id, symbol, side, entry_price, quantity).
+    """
+    if not rows:
+        return True
+
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
-        cursor.execute('''
-            INSERT OR REPLACE INTO position_snapshots (account_id, symbol, side, entry_price, quantity, updated_at)
-            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (account_id, symbol.upper(), side, entry_price, quantity))
+        _begin_immediate(cursor)
+        _upsert_position_snapshots(cursor, rows)
 
         conn.commit()
-        conn.close()
         return True
 
 
 def delete_position_snapshot(account_id, symbol):
     """Delete a position snapshot (when position is closed)."""
-    with db_lock:
-        conn = get_connection()
+    return delete_position_snapshots_bulk(account_id, [symbol])
+
+
+def delete_position_snapshots_bulk(account_id, symbols):
+    """Delete an account's position snapshots for several closed symbols in a single transaction."""
+    if not symbols:
+        return True
+
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
-        cursor.execute('DELETE FROM position_snapshots WHERE account_id = ? AND symbol = ?',
-                      (account_id, symbol.upper()))
+        _begin_immediate(cursor)
+        _delete_position_snapshots(cursor, account_id, symbols)
 
         conn.commit()
-        conn.close()
         return True
 
 
+def save_position_changes(account_id, notifications, snapshot_rows, closed_symbols):
+    """
+    Record one notifier pass for an account in a single transaction: the new notification
+    rows, the upserted snapshots of open positions and the deleted snapshots of closed ones.
+    A crash can't persist the notifications without the snapshot change that prevents them
+    from being raised again. Returns the new notification ids.
+    """
+    if not (notifications or snapshot_rows or closed_symbols):
+        return []
+
+    with get_connection(write=True) as conn:
+        cursor = conn.cursor()
+
+        _begin_immediate(cursor)
+        notification_ids = _insert_notifications(cursor, notifications)
+        _upsert_position_snapshots(cursor, snapshot_rows)
+        _delete_position_snapshots(cursor, account_id, closed_symbols)
+
+        conn.commit()
+        return notification_ids
+
+
 def clear_position_snapshots(account_id=None):
     """Clear position snapshots for an account or all accounts."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         if account_id:
@@ -2269,7 +2975,6 @@ def clear_position_snapshots(account_id=None):
             cursor.execute('DELETE FROM position_snapshots')
 
         conn.commit()
-        conn.close()
         return True
 
 
@@ -2277,59 +2982,70 @@ def clear_position_snapshots(account_id=None):
 
 def save_push_subscription(endpoint, p256dh, auth):
     """Save a push notification subscription."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
-            INSERT OR REPLACE INTO push_subscriptions (endpoint, p256dh, auth)
+            INSERT INTO push_subscriptions (endpoint, p256dh, auth)
             VALUES (?, ?, ?)
+            ON CONFLICT(endpoint) DO UPDATE SET p256dh = excluded.p256dh, auth = excluded.auth
         ''', (endpoint, p256dh, auth))
 
         conn.commit()
-        conn.close()
         return True
 
 
 def get_all_push_subscriptions():
     """Get all push subscriptions."""
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
+    return list(iter_push_subscriptions())
 
-        cursor.execute('SELECT endpoint, p256dh, auth FROM push_subscriptions')
 
-        subscriptions = []
-        for row in cursor.fetchall():
-            subscriptions.append({
+def iter_push_subscriptions(batch_size=500):
+    """
+    Yield push subscriptions one at a time.
+    Rows are read in id-ordered batches and the connection goes back to the pool
+    between batches, so none is held while the caller is sending notifications.
+    """
+    last_id = 0
+    while True:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, endpoint, p256dh, auth FROM push_subscriptions
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+
+        for row in rows:
+            yield {
                 'endpoint': row['endpoint'],
                 'keys': {
                     'p256dh': row['p256dh'],
                     'auth': row['auth']
                 }
-            })
+            }
 
-        conn.close()
-        return subscriptions
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['id']
 
 
 def delete_push_subscription(endpoint):
     """Delete a push subscription."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM push_subscriptions WHERE endpoint = ?', (endpoint,))
         conn.commit()
-        conn.close()
 
 
 # ==================== TRADE JOURNAL OPERATIONS ====================
 
 def get_closed_position_journal(position_id):
     """Get journal data for a closed position."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2339,55 +3055,44 @@ def get_closed_position_journal(position_id):
         ''', (position_id,))
 
         row = cursor.fetchone()
-        conn.close()
 
         if row:
-            import json
-            return {
-                'id': row['id'],
-                'symbol': row['symbol'],
-                'side': row['side'],
-                'realized_pnl': row['realized_pnl'],
-                'size_usd': row['size_usd'],
-                'exit_time': row['exit_time'],
-                'journal_notes': row['journal_notes'],
-                'emotion_tags': json.loads(row['emotion_tags']) if row['emotion_tags'] else [],
-                'mistake_tags': json.loads(row['mistake_tags']) if row['mistake_tags'] else [],
-                'rating': row['rating']
-            }
+            journal = dict(row)
+            journal['emotion_tags'] = _json_loads(row['emotion_tags']) if row['emotion_tags'] else []
+            journal['mistake_tags'] = _json_loads(row['mistake_tags']) if row['mistake_tags'] else []
+            return journal
         return None
 
 
 def update_closed_position_journal(position_id, journal_notes=None, emotion_tags=None,
                                    mistake_tags=None, rating=None):
     """Update journal data for a closed position."""
-    import json
-    with db_lock:
-        conn = get_connection()
-        cursor = conn.cursor()
-
-        updates = []
-        params = []
+    mask = 0
+    params = []
+
+    if journal_notes is not None:
+        mask |= 1
+        params.append(journal_notes)
+    if emotion_tags is not None:
+        mask |= 2
+        params.append(_json_dumps(emotion_tags))
+    if mistake_tags is not None:
+        mask |= 4
+        params.append(_json_dumps(mistake_tags))
+    if rating is not None:
+        mask |= 8
+        params.append(rating)
+
+    if not mask:
+        return True
 
-        if journal_notes is not None:
-            updates.append('journal_notes = ?')
-            params.append(journal_notes)
-        if emotion_tags is not None:
-            updates.append('emotion_tags = ?')
-            params.append(json.dumps(emotion_tags))
-        if mistake_tags is not None:
-            updates.append('mistake_tags = ?')
-            params.append(json.dumps(mistake_tags))
-        if rating is not None:
-            updates.append('rating = ?')
-            params.append(rating)
+    with get_connection(write=True) as conn:
+        cursor = conn.cursor()
 
-        if updates:
-            params.append(position_id)
-            cursor.execute(f'UPDATE closed_positions SET {", ".join(updates)} WHERE id = ?', params)
+        params.append(position_id)
+        cursor.execute(_UPDATE_JOURNAL_SQL[mask], params)
 
         conn.commit()
-        conn.close()
         return True
 
 
@@ -2397,8 +3102,7 @@ def create_strategy(name, account_id, symbol='BTCUSDC', fast_ema=7, slow_ema=19,
                     risk_percent=1.3, sl_lookback=4, sl_min_percent=0.25,
                     sl_max_percent=1.81, leverage=5, timeframe='30m'):
     """Create a new trading strategy. Returns strategy id."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2411,14 +3115,12 @@ def create_strategy(name, account_id, symbol='BTCUSDC', fast_ema=7, slow_ema=19,
 
         strategy_id = cursor.lastrowid
         conn.commit()
-        conn.close()
         return strategy_id
 
 
 def get_all_strategies():
     """Get all strategies with account info."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2455,14 +3157,12 @@ def get_all_strategies():
                 'updated_at': row['updated_at']
             })
 
-        conn.close()
         return strategies
 
 
 def get_strategies_by_account(account_id):
     """Get all strategies for a specific account."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2500,14 +3200,12 @@ def get_strategies_by_account(account_id):
                 'updated_at': row['updated_at']
             })
 
-        conn.close()
         return strategies
 
 
 def get_strategy(strategy_id):
     """Get a single strategy by ID."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2518,7 +3216,6 @@ def get_strategy(strategy_id):
         ''', (strategy_id,))
 
         row = cursor.fetchone()
-        conn.close()
 
         if row:
             return {
@@ -2550,22 +3247,19 @@ def get_strategy(strategy_id):
 
 def toggle_strategy_notifications(strategy_id, enabled):
     """Toggle push notifications for a strategy."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute(
             'UPDATE strategies SET notify_enabled = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
             (1 if enabled else 0, strategy_id)
         )
         conn.commit()
-        conn.close()
         return True
 
 
 def get_strategies_with_notifications_enabled():
     """Get all strategies that have notifications enabled."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT s.*, a.name as account_name, a.is_testnet, a.api_key, a.api_secret
@@ -2597,7 +3291,6 @@ def get_strategies_with_notifications_enabled():
                 'crossover_sl_short': row['crossover_sl_short'],
                 'crossover_time': row['crossover_time']
             })
-        conn.close()
         return strategies
 
 
@@ -2606,8 +3299,7 @@ def update_strategy(strategy_id, name=None, account_id=None, symbol=None,
                     sl_lookback=None, sl_min_percent=None, sl_max_percent=None,
                     leverage=None, timeframe=None, is_active=None):
     """Update a strategy."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         updates = ['updated_at = CURRENT_TIMESTAMP']
@@ -2651,31 +3343,27 @@ def update_strategy(strategy_id, name=None, account_id=None, symbol=None,
             params.append(1 if is_active else 0)
 
         params.append(strategy_id)
-        cursor.execute(f'UPDATE strategies SET {", ".join(updates)} WHERE id = ?', params)
+        cursor.execute(_update_sql('strategies', tuple(updates)), params)
 
         conn.commit()
-        conn.close()
         return True
 
 
 def delete_strategy(strategy_id):
     """Delete a strategy."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM strategies WHERE id = ?', (strategy_id,))
         deleted = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return deleted
 
 
 def update_strategy_crossover(strategy_id, direction, sl_long, sl_short):
     """Update strategy crossover data when a new crossover is detected."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2688,7 +3376,6 @@ def update_strategy_crossover(strategy_id, direction, sl_long, sl_short):
         ''', (direction, sl_long, sl_short, strategy_id))
 
         conn.commit()
-        conn.close()
         return True
 
 
@@ -2697,8 +3384,7 @@ def update_strategy_crossover(strategy_id, direction, sl_long, sl_short):
 def create_auto_trade(name, account_id, symbol='BTCUSDC', risk_percent=1.3,
                       sl_percent=0.5, leverage=5, margin_type='ISOLATED', order_type='MARKET'):
     """Create a new auto trade preset. Returns auto trade id."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2709,14 +3395,12 @@ def create_auto_trade(name, account_id, symbol='BTCUSDC', risk_percent=1.3,
 
         auto_trade_id = cursor.lastrowid
         conn.commit()
-        conn.close()
         return auto_trade_id
 
 
 def get_auto_trades_by_account(account_id):
     """Get all auto trades for a specific account."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2741,21 +3425,18 @@ def get_auto_trades_by_account(account_id):
                 'updated_at': row['updated_at']
             })
 
-        conn.close()
         return auto_trades
 
 
 def get_auto_trade(auto_trade_id):
     """Get a single auto trade by ID."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('SELECT * FROM auto_trades WHERE id = ?', (auto_trade_id,))
         row = cursor.fetchone()
 
         if not row:
-            conn.close()
             return None
 
         auto_trade = {
@@ -2772,7 +3453,6 @@ def get_auto_trade(auto_trade_id):
             'updated_at': row['updated_at']
         }
 
-        conn.close()
         return auto_trade
 
 
@@ -2784,8 +3464,7 @@ def update_auto_trade(auto_trade_id, **fields):
     if not updates:
         return False
 
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         set_clause = ', '.join(f'{k} = ?' for k in updates)
@@ -2800,20 +3479,17 @@ def update_auto_trade(auto_trade_id, **fields):
 
         updated = cursor.rowcount > 0
         conn.commit()
-        conn.close()
         return updated
 
 
 def delete_auto_trade(auto_trade_id):
     """Delete an auto trade."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM auto_trades WHERE id = ?', (auto_trade_id,))
         deleted = cursor.rowcount > 0
         conn.commit()
-        conn.close()
         return deleted
 
 
@@ -2821,8 +3497,7 @@ def delete_auto_trade(auto_trade_id):
 
 def get_all_rule_sections():
     """Get all rule sections with their rules."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -2860,16 +3535,16 @@ def get_all_rule_sections():
 
             sections.append(section)
 
-        conn.close()
         return sections
 
 
 def create_rule_section(name, display_order=None):
     """Create a new rule section. Returns section id."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        _begin_immediate(cursor)
+
         if display_order is None:
             cursor.execute('SELECT COALESCE(MAX(display_order), 0) + 1 as next_order FROM rule_sections')
             row = cursor.fetchone()
@@ -2882,14 +3557,12 @@ def create_rule_section(name, display_order=None):
         section_id = cursor.lastrowid
 
         conn.commit()
-        conn.close()
         return section_id
 
 
 def update_rule_section(section_id, name=None, display_order=None):
     """Update a rule section."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         updates = []
@@ -2904,19 +3577,19 @@ def update_rule_section(section_id, name=None, display_order=None):
 
         if updates:
             params.append(section_id)
-            cursor.execute(f'UPDATE rule_sections SET {", ".join(updates)} WHERE id = ?', params)
+            cursor.execute(_update_sql('rule_sections', tuple(updates)), params)
 
         conn.commit()
-        conn.close()
         return True
 
 
 def delete_rule_section(section_id):
     """Delete a rule section and all its rules."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        _begin_immediate(cursor)
+
         # Delete all rules in the section first
         cursor.execute('DELETE FROM trading_rules WHERE section_id = ?', (section_id,))
         # Delete the section
@@ -2924,16 +3597,16 @@ def delete_rule_section(section_id):
         deleted = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return deleted
 
 
 def reorder_rule_sections(section_ids):
     """Reorder rule sections based on the provided list of IDs."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        _begin_immediate(cursor)
+
         for index, section_id in enumerate(section_ids):
             cursor.execute(
                 'UPDATE rule_sections SET display_order = ? WHERE id = ?',
@@ -2941,7 +3614,6 @@ def reorder_rule_sections(section_ids):
             )
 
         conn.commit()
-        conn.close()
         return True
 
 
@@ -2949,8 +3621,7 @@ def reorder_rule_sections(section_ids):
 
 def get_all_trading_rules(section_id=None):
     """Get all trading rules ordered by display_order, optionally filtered by section."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection() as conn:
         cursor = conn.cursor()
 
         if section_id:
@@ -2977,16 +3648,16 @@ def get_all_trading_rules(section_id=None):
                 'created_at': row['created_at']
             })
 
-        conn.close()
         return rules
 
 
 def create_trading_rule(rule_text, section_id, display_order=None):
     """Create a new trading rule. Returns rule id."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        _begin_immediate(cursor)
+
         # If no display_order specified, put it at the end for this section
         if display_order is None:
             cursor.execute('SELECT COALESCE(MAX(display_order), 0) + 1 as next_order FROM trading_rules WHERE section_id = ?', (section_id,))
@@ -3000,14 +3671,12 @@ def create_trading_rule(rule_text, section_id, display_order=None):
         rule_id = cursor.lastrowid
 
         conn.commit()
-        conn.close()
         return rule_id
 
 
 def update_trading_rule(rule_id, rule_text=None, display_order=None):
     """Update a trading rule."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         updates = []
@@ -3022,33 +3691,31 @@ def update_trading_rule(rule_id, rule_text=None, display_order=None):
 
         if updates:
             params.append(rule_id)
-            cursor.execute(f'UPDATE trading_rules SET {", ".join(updates)} WHERE id = ?', params)
+            cursor.execute(_update_sql('trading_rules', tuple(updates)), params)
 
         conn.commit()
-        conn.close()
         return True
 
 
 def delete_trading_rule(rule_id):
     """Delete a trading rule."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
         cursor.execute('DELETE FROM trading_rules WHERE id = ?', (rule_id,))
         deleted = cursor.rowcount > 0
 
         conn.commit()
-        conn.close()
         return deleted
 
 
 def reorder_trading_rules(rule_ids):
     """Reorder trading rules based on the provided list of IDs."""
-    with db_lock:
-        conn = get_connection()
+    with get_connection(write=True) as conn:
         cursor = conn.cursor()
 
+        _begin_immediate(cursor)
+
         for index, rule_id in enumerate(rule_ids):
             cursor.execute(
                 'UPDATE trading_rules SET display_order = ? WHERE id = ?',
@@ -3056,7 +3723,6 @@ def reorder_trading_rules(rule_ids):
             )
 
         conn.commit()
-        conn.close()
         return True
 
 
@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database.py runs init_db() on import; keep that away from the real trades.db
+os.environ.setdefault('TRADES_DB_PATH', os.path.join(tempfile.mkdtemp(), 'trades.db'))
+
+import database  # noqa: E402
+
+BASELINE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'fixtures', 'baseline_schema.sql')
+
+
+def _reset_caches():
+    """Forget cached reads from the previous test's database."""
+    database._closed_stats_cache.clear()
+    database._settings_cache.clear()
+    database._user_count_cache[0] = None
+    database._registration_open_cache[0] = None
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Point the module at an empty database file for the duration of one test."""
+    database.close_all_connections()
+    path = str(tmp_path / 'trades.db')
+    monkeypatch.setattr(database, 'DB_PATH', path)
+    monkeypatch.setattr(database, '_wal_enabled', False)
+    _reset_caches()
+    yield path
+    database.close_all_connections()
+    _reset_caches()
+
+
+@pytest.fixture
+def db(db_path):
+    """A freshly initialised database."""
+    database.init_db()
+    return database
+
+
+@pytest.fixture
+def account_id(db):
+    return db.create_account('Main', 'key', 'secret')
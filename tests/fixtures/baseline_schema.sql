@@ -0,0 +1,229 @@
+-- Schema and seed rows written by the original init_db() (user_version 0), used as the
+-- starting point for the migration tests
+BEGIN TRANSACTION;
+CREATE TABLE accounts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                api_key TEXT NOT NULL,
+                api_secret TEXT NOT NULL,
+                is_testnet INTEGER DEFAULT 0,
+                total_trades INTEGER DEFAULT 0,
+                total_pnl REAL DEFAULT 0,
+                total_commission REAL DEFAULT 0,
+                winning_trades INTEGER DEFAULT 0,
+                losing_trades INTEGER DEFAULT 0,
+                current_balance REAL DEFAULT 0,
+                starting_balance REAL DEFAULT 0,
+                avg_win REAL DEFAULT 0,
+                avg_loss REAL DEFAULT 0,
+                largest_win REAL DEFAULT 0,
+                largest_loss REAL DEFAULT 0,
+                profit_factor REAL DEFAULT 0,
+                total_volume REAL DEFAULT 0,
+                last_sync_time TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+CREATE TABLE app_settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+INSERT INTO "app_settings" VALUES('registration_open','true');
+CREATE TABLE auto_trades (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                account_id INTEGER NOT NULL,
+                symbol TEXT NOT NULL DEFAULT 'BTCUSDC',
+                risk_percent REAL NOT NULL DEFAULT 1.3,
+                sl_percent REAL NOT NULL DEFAULT 0.5,
+                leverage INTEGER NOT NULL DEFAULT 5,
+                margin_type TEXT NOT NULL DEFAULT 'ISOLATED',
+                order_type TEXT NOT NULL DEFAULT 'MARKET',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+            );
+CREATE TABLE cache_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+CREATE TABLE closed_positions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id INTEGER NOT NULL,
+                symbol TEXT NOT NULL,
+                side TEXT NOT NULL,
+                quantity REAL NOT NULL,
+                entry_price REAL NOT NULL,
+                exit_price REAL NOT NULL,
+                size_usd REAL NOT NULL,
+                realized_pnl REAL NOT NULL,
+                commission REAL DEFAULT 0,
+                entry_time TIMESTAMP,
+                exit_time TIMESTAMP,
+                duration_seconds INTEGER,
+                trade_ids TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, setup_id INTEGER REFERENCES setups(id) ON DELETE SET NULL, journal_notes TEXT, emotion_tags TEXT, mistake_tags TEXT, rating INTEGER,
+                FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+            );
+CREATE TABLE open_positions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id INTEGER NOT NULL,
+                symbol TEXT NOT NULL,
+                side TEXT NOT NULL,
+                quantity REAL NOT NULL,
+                entry_price REAL NOT NULL,
+                mark_price REAL NOT NULL,
+                unrealized_pnl REAL DEFAULT 0,
+                leverage INTEGER DEFAULT 1,
+                stop_price REAL,
+                stop_order_id INTEGER,
+                stop_type TEXT,
+                tp_price REAL,
+                tp_order_id INTEGER,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE,
+                UNIQUE(account_id, symbol)
+            );
+CREATE TABLE position_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id INTEGER NOT NULL,
+                symbol TEXT NOT NULL,
+                side TEXT NOT NULL,
+                entry_price REAL,
+                quantity REAL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(account_id, symbol),
+                FOREIGN KEY (account_id) REFERENCES accounts(id)
+            );
+CREATE TABLE push_subscriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                endpoint TEXT UNIQUE NOT NULL,
+                p256dh TEXT NOT NULL,
+                auth TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+CREATE TABLE rule_sections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                display_order INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+INSERT INTO "rule_sections" VALUES(1,'Spot Trading Rules',0,'2026-10-16 18:31:20');
+INSERT INTO "rule_sections" VALUES(2,'Futures Trading Rules',1,'2026-10-16 18:31:20');
+CREATE TABLE settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+INSERT INTO "settings" VALUES('trade_notifications_enabled','1');
+CREATE TABLE setup_folders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                description TEXT,
+                color TEXT DEFAULT '#fbbf24',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+CREATE TABLE setup_images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                setup_id INTEGER NOT NULL,
+                timeframe TEXT NOT NULL,
+                image_path TEXT NOT NULL,
+                notes TEXT,
+                display_order INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (setup_id) REFERENCES setups(id) ON DELETE CASCADE
+            );
+CREATE TABLE setups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                folder_id INTEGER,
+                name TEXT NOT NULL,
+                description TEXT,
+                timeframe TEXT,
+                image_data TEXT,
+                notes TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (folder_id) REFERENCES setup_folders(id) ON DELETE SET NULL
+            );
+CREATE TABLE strategies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                account_id INTEGER NOT NULL,
+                symbol TEXT NOT NULL DEFAULT 'BTCUSDC',
+                fast_ema INTEGER NOT NULL DEFAULT 7,
+                slow_ema INTEGER NOT NULL DEFAULT 19,
+                risk_percent REAL NOT NULL DEFAULT 1.3,
+                sl_lookback INTEGER NOT NULL DEFAULT 4,
+                sl_min_percent REAL NOT NULL DEFAULT 0.25,
+                sl_max_percent REAL NOT NULL DEFAULT 1.81,
+                leverage INTEGER NOT NULL DEFAULT 5,
+                timeframe TEXT NOT NULL DEFAULT '30m',
+                is_active INTEGER DEFAULT 1,
+                crossover_direction TEXT,
+                crossover_sl_long REAL,
+                crossover_sl_short REAL,
+                crossover_time TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, notify_enabled INTEGER DEFAULT 0,
+                FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+            );
+CREATE TABLE trade_notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id INTEGER NOT NULL,
+                symbol TEXT NOT NULL,
+                side TEXT NOT NULL,
+                event_type TEXT NOT NULL CHECK(event_type IN ('opened', 'closed')),
+                entry_price REAL,
+                exit_price REAL,
+                pnl REAL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (account_id) REFERENCES accounts(id)
+            );
+CREATE TABLE trades (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                account_id INTEGER NOT NULL,
+                exchange_trade_id TEXT UNIQUE,
+                order_id TEXT,
+                symbol TEXT NOT NULL,
+                side TEXT NOT NULL CHECK(side IN ('LONG', 'SHORT', 'BUY', 'SELL')),
+                quantity REAL NOT NULL,
+                price REAL NOT NULL,
+                realized_pnl REAL DEFAULT 0,
+                commission REAL DEFAULT 0,
+                commission_asset TEXT,
+                trade_time TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+            );
+CREATE TABLE trading_rules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                rule_text TEXT NOT NULL,
+                section_id INTEGER,
+                rule_type TEXT DEFAULT 'spot',
+                display_order INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (section_id) REFERENCES rule_sections(id) ON DELETE CASCADE
+            );
+CREATE TABLE users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                salt TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+CREATE INDEX idx_trades_account_id ON trades(account_id);
+CREATE INDEX idx_trades_symbol ON trades(symbol);
+CREATE INDEX idx_trades_trade_time ON trades(trade_time);
+CREATE UNIQUE INDEX idx_trades_exchange_id ON trades(exchange_trade_id);
+CREATE INDEX idx_positions_account_id ON open_positions(account_id);
+CREATE INDEX idx_closed_positions_account_id ON closed_positions(account_id);
+CREATE INDEX idx_closed_positions_exit_time ON closed_positions(exit_time);
+CREATE INDEX idx_setups_folder_id ON setups(folder_id);
+CREATE INDEX idx_setup_images_setup_id ON setup_images(setup_id);
+CREATE INDEX idx_closed_positions_setup_id ON closed_positions(setup_id);
+CREATE INDEX idx_trade_notifications_account ON trade_notifications(account_id);
+CREATE INDEX idx_strategies_account_id ON strategies(account_id);
+CREATE INDEX idx_auto_trades_account_id ON auto_trades(account_id);
+DELETE FROM "sqlite_sequence";
+INSERT INTO "sqlite_sequence" VALUES('rule_sections',2);
+COMMIT;
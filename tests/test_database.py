@@ -0,0 +1,236 @@
+import queue
+import sqlite3
+
+import pytest
+
+import database
+from conftest import BASELINE_SCHEMA
+
+# The closed_positions_summary columns, recomputed from scratch
+_RECOMPUTED_SUMMARY = '''
+    SELECT
+        account_id, COUNT(*), SUM(realized_pnl), COALESCE(SUM(commission), 0),
+        SUM(quantity * entry_price), SUM(realized_pnl > 0), SUM(realized_pnl < 0),
+        SUM(realized_pnl = 0), SUM(MAX(realized_pnl, 0)), SUM(MIN(realized_pnl, 0)),
+        MAX(realized_pnl), MIN(realized_pnl), COALESCE(SUM(duration_seconds), 0),
+        COUNT(duration_seconds)
+    FROM closed_positions
+    GROUP BY account_id
+    ORDER BY account_id
+'''
+_STORED_SUMMARY = '''
+    SELECT
+        account_id, total_positions, sum_pnl, sum_commission, sum_volume, winning, losing,
+        breakeven, sum_win, sum_loss, max_pnl, min_pnl, sum_duration, duration_count
+    FROM closed_positions_summary
+    ORDER BY account_id
+'''
+
+
+def _trade(n, trade_time, symbol='BTCUSDT'):
+    return (1000 + n, 5000 + n, symbol, 'BUY', 1.0, 100.0 + n, 0.0, 0.01, 'USDT', trade_time)
+
+
+def _sequence(db, table):
+    with db.get_connection() as conn:
+        row = conn.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    return row[0] if row else None
+
+
+def _assert_summary_matches(db):
+    with db.get_connection() as conn:
+        stored = [tuple(row) for row in conn.execute(_STORED_SUMMARY)]
+        recomputed = [tuple(row) for row in conn.execute(_RECOMPUTED_SUMMARY)]
+    assert len(stored) == len(recomputed)
+    for got, want in zip(stored, recomputed):
+        assert got == pytest.approx(want)
+
+
+def _all_pages(db, account_id, limit):
+    rows, before = [], None
+    while True:
+        page = db.get_trades(account_id, limit=limit, before=before)
+        rows.extend(page)
+        if len(page) < limit:
+            return rows
+        before = (page[-1]['trade_time'] or '', page[-1]['id'])
+
+
+# ==================== MIGRATION ====================
+
+def test_migrates_baseline_database(db_path):
+    conn = sqlite3.connect(db_path)
+    with open(BASELINE_SCHEMA) as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO accounts (name, api_key, api_secret) VALUES ('Main', 'key', 'secret')")
+    conn.executemany('''
+        INSERT INTO trades (account_id, exchange_trade_id, order_id, symbol, side, quantity,
+                            price, realized_pnl, commission, commission_asset, trade_time)
+        VALUES (1, ?, ?, 'BTCUSDT', 'BUY', 1.0, ?, ?, 0.01, 'USDT', ?)
+    ''', [(str(n), str(n), 100.0 + n, n - 2.0, f'2024-01-0{n}T00:00:00') for n in range(1, 5)])
+    conn.executemany('''
+        INSERT INTO closed_positions (account_id, symbol, side, quantity, entry_price, exit_price,
+                                      size_usd, realized_pnl, commission, entry_time, exit_time)
+        VALUES (1, 'BTCUSDT', 'LONG', 1.0, 100.0, ?, 100.0, ?, 0.1,
+                '2024-01-01T00:00:00', '2024-01-01T01:00:00')
+    ''', [(110.0, 10.0), (95.0, -5.0)])
+    # Trade 4 was the newest; AUTOINCREMENT must not hand its id out again
+    conn.execute('DELETE FROM trades WHERE id = 4')
+    conn.commit()
+    conn.close()
+
+    database.init_db()
+
+    with database.get_connection() as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == database.SCHEMA_VERSION
+        assert conn.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+        trades = conn.execute(
+            'SELECT id, exchange_trade_id, price, realized_pnl, trade_time FROM trades ORDER BY id'
+        ).fetchall()
+    assert [tuple(row) for row in trades] == [
+        (n, str(n), 100.0 + n, n - 2.0, f'2024-01-0{n}T00:00:00') for n in range(1, 4)
+    ]
+    assert _sequence(database, 'trades') == 4
+    assert _sequence(database, 'closed_positions') == 2
+    assert database.get_closed_positions_count(1) == 2
+    _assert_summary_matches(database)
+
+    assert database.insert_trades_bulk(1, [_trade(9, '2024-02-01T00:00:00')]) == 1
+    assert database.get_trades(1, limit=1)[0]['id'] == 5
+
+    # A second start finds the schema current and leaves it alone
+    database.init_db()
+    assert database.get_trades_count(1) == 4
+
+
+# ==================== WIPE ====================
+
+def test_wipe_keeps_ids_monotonic(db, account_id):
+    db.insert_trades_bulk(account_id, [_trade(n, f'2024-01-0{n}T00:00:00') for n in range(1, 6)])
+    for pnl in (10.0, -5.0, 3.0):
+        db.insert_closed_position(account_id, 'BTCUSDT', 'LONG', 1.0, 100.0, 100.0 + pnl, pnl,
+                                  0.1, '2024-01-01T00:00:00', '2024-01-01T01:00:00')
+    db.delete_closed_position(3)
+
+    assert db.delete_all_trades_and_positions() == (5, 2)
+    assert db.get_trades_count() == 0
+    assert db.get_closed_positions_count() == 0
+    _assert_summary_matches(db)
+
+    db.insert_trades_bulk(account_id, [_trade(1, '2024-03-01T00:00:00')])
+    position_id = db.insert_closed_position(account_id, 'BTCUSDT', 'LONG', 1.0, 100.0, 101.0, 1.0,
+                                            0.1, '2024-03-01T00:00:00', '2024-03-01T01:00:00')
+    assert db.get_trades(account_id)[0]['id'] == 6
+    assert position_id == 4
+
+
+# ==================== CLOSED POSITIONS SUMMARY ====================
+
+def test_summary_triggers_track_inserts_updates_and_deletes(db, account_id):
+    other_id = db.create_account('Other', 'key2', 'secret2')
+    ids = []
+    for account, pnl, exit_time in [
+        (account_id, 10.0, '2024-01-01T01:00:00'),
+        (account_id, -4.0, '2024-01-01T02:30:00'),
+        (account_id, 0.0, None),
+        (account_id, 25.0, '2024-01-01T00:10:00'),
+        (other_id, -7.5, '2024-01-01T03:00:00'),
+    ]:
+        ids.append(db.insert_closed_position(account, 'BTCUSDT', 'LONG', 2.0, 50.0, 55.0, pnl,
+                                             0.2, '2024-01-01T00:00:00', exit_time))
+    _assert_summary_matches(db)
+
+    with db.get_connection(write=True) as conn:
+        conn.execute('UPDATE closed_positions SET realized_pnl = -30.0 WHERE id = ?', (ids[0],))
+        conn.execute('UPDATE closed_positions SET quantity = 3.0, commission = NULL WHERE id = ?',
+                     (ids[1],))
+        conn.execute('UPDATE closed_positions SET account_id = ? WHERE id = ?', (other_id, ids[2]))
+    _assert_summary_matches(db)
+
+    # Deleting the current max and min makes the triggers re-read them
+    db.delete_closed_position(ids[3])
+    db.delete_closed_position(ids[0])
+    _assert_summary_matches(db)
+
+    # An account's last position takes its summary row with it
+    db.delete_closed_position(ids[1])
+    _assert_summary_matches(db)
+    with db.get_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM closed_positions_summary WHERE account_id = ?',
+                            (account_id,)).fetchone()[0] == 0
+
+
+# ==================== TRADES PAGING ====================
+
+def test_keyset_pages_return_every_trade_once(db, account_id):
+    # Runs of equal trade_time straddle the page boundaries
+    times = [f'2024-01-{day:02d}T00:00:00' for day in (1, 2, 2, 2, 2, 2, 3, 4, 4, 4, 4, 5, 5)]
+    db.insert_trades_bulk(account_id, [_trade(n, t) for n, t in enumerate(times)])
+    db.insert_trades_bulk(db.create_account('Other', 'key2', 'secret2'),
+                          [_trade(100 + n, '2024-01-02T00:00:00') for n in range(3)])
+
+    expected = db.get_trades(account_id, limit=1000)
+    assert len(expected) == len(times)
+    for limit in (1, 2, 3, 4, 5, len(times)):
+        assert _all_pages(db, account_id, limit) == expected
+
+
+def test_keyset_pages_reach_trades_without_a_time(db, account_id):
+    times = ['2024-01-02T00:00:00', None, '2024-01-01T00:00:00', '2024-01-02T00:00:00', None,
+             '2024-01-02T00:00:00', None, '2024-01-01T00:00:00']
+    db.insert_trades_bulk(account_id, [_trade(n, t) for n, t in enumerate(times)])
+
+    # Newest first, ties by id, undated trades last
+    expected = db.get_trades(account_id, limit=1000)
+    assert [t['trade_time'] for t in expected] == (
+        ['2024-01-02T00:00:00'] * 3 + ['2024-01-01T00:00:00'] * 2 + [None] * 3
+    )
+    for start, end in ((0, 3), (3, 5), (5, 8)):
+        ids = [t['id'] for t in expected[start:end]]
+        assert ids == sorted(ids)
+
+    for limit in (1, 2, 3, 4, 5, 6, 7, len(times)):
+        pages = _all_pages(db, account_id, limit)
+        assert [t['id'] for t in pages] == [t['id'] for t in expected]
+
+    # A cursor inside the undated tail continues from it
+    last_undated = expected[5]
+    assert db.get_trades(account_id, before=('', last_undated['id'])) == expected[6:]
+
+
+# ==================== CONNECTIONS ====================
+
+class _RollbackFails:
+    """A write connection stuck mid-transaction whose rollback fails."""
+
+    in_transaction = True
+
+    def __init__(self):
+        self.closed = False
+
+    def rollback(self):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    def close(self):
+        self.closed = True
+
+
+def test_writer_slot_survives_failed_rollback(db):
+    conn = db._write_pool.get_nowait()
+    if conn is not None:
+        conn.close()
+    broken = _RollbackFails()
+    db._write_pool.put_nowait(broken)
+
+    with pytest.raises(sqlite3.OperationalError):
+        with db.get_connection(write=True):
+            pass
+
+    assert broken.closed
+    try:
+        assert db._write_pool.get(timeout=1) is None
+    except queue.Empty:
+        pytest.fail('writer slot was not released')
+    db._write_pool.put_nowait(None)
+    db.set_setting('trade_notifications_enabled', '0')
+    assert db.get_setting('trade_notifications_enabled') == '0'